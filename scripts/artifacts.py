@@ -0,0 +1,134 @@
+# Concurrent, content-hashed artifact upload for the mlflow runs of track.py
+# Files are hashed before the upload. A file whose content was already sent in this run, or in an
+# earlier run recorded in the index file, is skipped; the run's artifact_manifest.json then points
+# to the run and path where that content is stored.
+
+import os
+import json
+import time
+import hashlib
+from os.path import join, basename, dirname
+from concurrent.futures import ThreadPoolExecutor
+from tqdm import tqdm
+
+# content uploaded by earlier runs, shared by track.py and runstore.py sync
+defaultIndex = join(os.path.expanduser("~"), ".siminhale", "artifacts.json")
+
+def fileHash(path, blockSize=1 << 20):
+    # sha256 of a file read in blocks
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(blockSize), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+class ArtifactUploader:
+    def __init__(self, client, runId, indexFile=None, workers=8, retries=3):
+        self.client = client
+        self.runId = runId
+        self.indexFile = indexFile
+        self.workers = workers
+        self.retries = retries
+        self.queue = []
+        # local path -> sha256 given by the caller, these files are not hashed again
+        self.hashes = {}
+
+    def add(self, localPath, artifactPath=None, sha256=None):
+        self.queue.append((localPath, artifactPath))
+        if sha256:
+            self.hashes[localPath] = sha256
+
+    def loadIndex(self):
+        if not self.indexFile or not os.path.exists(self.indexFile):
+            return {}
+        with open(self.indexFile, "r") as f:
+            return json.load(f)
+
+    def saveIndex(self, stored):
+        if not self.indexFile:
+            return
+        os.makedirs(dirname(self.indexFile) or ".", exist_ok=True)
+        # merge with what other runs wrote in the meantime
+        index = self.loadIndex()
+        index.update(stored)
+        with open(self.indexFile + ".tmp", "w") as f:
+            json.dump(index, f)
+        os.replace(self.indexFile + ".tmp", self.indexFile)
+
+    def send(self, localPath, artifactPath):
+        for attempt in range(self.retries):
+            try:
+                self.client.log_artifact(self.runId, localPath, artifactPath)
+                return None
+            except Exception as e:
+                error = e
+                # no wait after the last attempt
+                if attempt < self.retries - 1:
+                    time.sleep(2**attempt)
+        return error
+
+    def inspect(self, localPath):
+        # ((sha256, size), None) of a queued file, (None, error) if it cannot be read
+        try:
+            return (self.hashes.get(localPath) or fileHash(localPath), os.path.getsize(localPath)), None
+        except OSError as e:
+            return None, e
+
+    def upload(self):
+        # Upload the queued files, returns (bytes sent, bytes skipped, failed files)
+        print("Hashing Artifacts:")
+        localPaths = [localPath for localPath, _ in self.queue]
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            inspected = list(tqdm(pool.map(self.inspect, localPaths), total=len(localPaths)))
+
+        index = self.loadIndex()
+        stored = {}
+        manifest = []
+        toSend = []
+        # files that cannot be read fail on their own, the others are still sent
+        unreadable = []
+        for (localPath, artifactPath), (info, error) in zip(self.queue, inspected):
+            if error is not None:
+                unreadable.append((localPath, error))
+                continue
+            digest, size = info
+            entry = {"file": join(artifactPath or "", basename(localPath)), "sha256": digest, "size": size}
+            sending = digest not in stored and digest not in index
+            if sending:
+                stored[digest] = {"runId": self.runId, "path": entry["file"]}
+                toSend.append((localPath, artifactPath, digest))
+            manifest.append((entry, localPath, sending))
+
+        print("Uploading Artifacts:")
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = [pool.submit(self.send, localPath, artifactPath) for localPath, artifactPath, _ in toSend]
+            errors = [future.result() for future in tqdm(futures)]
+
+        failed = {}
+        for (localPath, _, digest), error in zip(toSend, errors):
+            if error is not None:
+                failed[digest] = (localPath, error)
+                del stored[digest]
+        # where each content is stored is known only now, a copy of a failed upload failed as well
+        failedPaths = [localPath for localPath, _ in unreadable]
+        for entry, localPath, sending in manifest:
+            entry["failed"] = entry["sha256"] in failed
+            if entry["failed"]:
+                failedPaths.append(localPath)
+            elif not sending:
+                entry["storedIn"] = stored.get(entry["sha256"]) or index[entry["sha256"]]
+        manifest = [entry for entry, _, _ in manifest]
+
+        self.saveIndex(stored)
+        self.client.log_dict(self.runId, manifest, "artifact_manifest.json")
+
+        skipped = [entry for entry in manifest if "storedIn" in entry]
+        bytesSent = sum(entry["size"] for entry in manifest if "storedIn" not in entry and not entry["failed"])
+        bytesSkipped = sum(entry["size"] for entry in skipped)
+        print("Artifacts sent: ", len(stored), " files, ", bytesSent, " bytes")
+        print("Artifacts skipped: ", len(skipped), " files, ", bytesSkipped, " bytes")
+        for localPath, error in unreadable + list(failed.values()):
+            print(f"Failed to upload {localPath}: {type(error).__name__}: {error}")
+        self.queue = []
+        self.hashes = {}
+        return bytesSent, bytesSkipped, failedPaths
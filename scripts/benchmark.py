@@ -0,0 +1,215 @@
+# Benchmarks the post-processing stages on synthetic particle clouds
+# Usage: python benchmark.py --scales <comma separated particle counts> --repeat <runs> --csv <file> --baseline <csv> --tolerance <fraction>
+# Example: python3 benchmark.py --scales 1e4,1e5,1e6 --csv benchmark.csv
+# The clouds have the siminhale_*.csv columns, deposited particles are sampled inside the segment
+# spheres and the mouth/throat slab. Every stage is timed (best of --repeat) and run once more under
+# tracemalloc for its peak memory. Before timing, the optimized classifiers are checked against the
+# row-wise categorise() on --checkSize points, and so are the snapshots read by loadSnapshot, whose sidecar
+# columns must be memory-mapped; any difference or copied column fails the run.
+# With --baseline, stages more than --tolerance slower than in the baseline csv fail the run.
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+from segments import categorise, classifyFrame, sphereCenters, sphereRadii
+from deposition import DepositionCounts
+from spatialindex import SphereIndex
+from voxelgrid import VoxelGrid, airwayBounds
+from snapshots import loadSnapshot, sidecarPath
+from split_particles import splitFile, splitFileMultiway, multiwayFolders
+
+def sampleSpheres(rng, n):
+    # uniform points inside the segment spheres, spheres picked by volume
+    weights = sphereRadii**3 / np.sum(sphereRadii**3)
+    sphere = rng.choice(len(sphereRadii), size=n, p=weights)
+    direction = rng.normal(size=(n, 3))
+    direction /= np.linalg.norm(direction, axis=1)[:, None]
+    radius = sphereRadii[sphere] * rng.random(n)**(1 / 3)
+    return sphereCenters[sphere] + direction * radius[:, None]
+
+def syntheticCloud(n, seed=0, deposited=0.15, escaped=0.6, errored=0.001, mouth=0.5):
+    # n particles: deposited ones in the airway (mouth of them in the z >= -0.06 slab), the rest spread
+    # over the airway bounding box, escaped and errored flags drawn independently of the position
+    rng = np.random.default_rng(seed)
+    low, high = airwayBounds()
+    status = rng.choice(3, size=n, p=[deposited, escaped, 1 - deposited - escaped])
+    points = low + rng.random((n, 3)) * (high - low)
+
+    isDeposited = np.flatnonzero(status == 0)
+    inMouth = rng.random(len(isDeposited)) < mouth
+    mouthIdx = isDeposited[inMouth]
+    points[mouthIdx, 2] = -0.06 + rng.random(len(mouthIdx)) * 0.04
+    points[isDeposited[~inMouth]] = sampleSpheres(rng, np.count_nonzero(~inMouth))
+
+    return pd.DataFrame({"x": points[:, 0], "y": points[:, 1], "z": points[:, 2], "u": np.zeros(n),
+                         "deposition": (status == 0).astype(np.int64), "escaped": (status == 1).astype(np.int64),
+                         "error": (rng.random(n) < errored).astype(np.int64)})
+
+def checkClassifiers(df, voxelGrids):
+    # Number of labels that differ from categorise, per classifier
+    differences = {}
+    for moreSeg in [False, True]:
+        reference = df.apply(categorise, axis=1, moreSeg=moreSeg).to_numpy()
+        candidates = {"classify": classifyFrame(df, moreSeg=moreSeg),
+                      "sphere index": classifyFrame(df, SphereIndex().classify, moreSeg=moreSeg),
+                      "voxel grid": classifyFrame(df, voxelGrids[moreSeg].classify)}
+        for name, labels in candidates.items():
+            differences[f"{name}{' (moreSegments)' if moreSeg else ''}"] = int(np.count_nonzero(labels != reference))
+    return differences
+
+def memoryMapped(array, path):
+    # whether array is a view of a memory map of the file at path
+    while array is not None:
+        if isinstance(array, np.memmap) and os.path.samefile(array.filename, path):
+            return True
+        array = getattr(array, "base", None)
+    return False
+
+def checkSnapshots(df, workdir):
+    # Labels of the snapshots read by loadSnapshot (parsed, then from the sidecar) that differ from
+    # categorise on the csv, and the sidecar columns that were copied instead of memory-mapped
+    csvFile = os.path.join(workdir, "siminhale_0.csv")
+    # few digits like the solver writes, so points land exactly on segment boundaries
+    df.to_csv(csvFile, index=False, float_format="%.4f")
+    reference = pd.read_csv(csvFile).apply(categorise, axis=1).to_numpy()
+    differences = {}
+    for source in ["csv", "sidecar"]:
+        loaded = loadSnapshot(csvFile, ["x", "y", "z"])
+        differences[f"loadSnapshot ({source})"] = int(np.count_nonzero(classifyFrame(loaded) != reference))
+    copied = [column for column in loaded.columns
+              if not memoryMapped(loaded[column].to_numpy(), os.path.join(sidecarPath(csvFile), column + ".npy"))]
+    return differences, copied
+
+def plotStage(csvFile, workdir):
+    # ParticleSimulation.plotDepositionFraction without a tracked run
+    from track import ParticleSimulation
+    simulation = ParticleSimulation.__new__(ParticleSimulation)
+    # draw and classify every time instead of reading the caches
+    simulation.figureCache = None
+    simulation.labelCache = None
+    simulation.plotDepositionFraction(csvFile, os.path.join(workdir, "deposition_fraction."), ["png"])
+
+def stages(df, workdir, voxelGrid, referenceLimit):
+    # stage name -> function, the csv stages share siminhale_0.csv written by "csv write"
+    csvFile = os.path.join(workdir, "siminhale_0.csv")
+    depositedPath = os.path.join(workdir, "deposited")
+    notDepositedPath = os.path.join(workdir, "not_deposited")
+    for folder in [depositedPath, notDepositedPath] + multiwayFolders(workdir):
+        os.makedirs(folder, exist_ok=True)
+
+    sphereIndex = SphereIndex()
+    sectioned = df.assign(section=classifyFrame(df))
+
+    def percentages():
+        counts = DepositionCounts()
+        counts.add(sectioned)
+        return counts.grouped()
+
+    result = {}
+    if len(df) <= referenceLimit:
+        result["categorise (reference)"] = lambda: df.apply(categorise, axis=1)
+    result.update({
+        "classify": lambda: classifyFrame(df),
+        "classify moreSegments": lambda: classifyFrame(df, moreSeg=True),
+        "sphere index": lambda: classifyFrame(df, sphereIndex.classify),
+        "voxel grid": lambda: classifyFrame(df, voxelGrid.classify),
+        "percentages": percentages,
+        "csv write": lambda: df.to_csv(csvFile, index=False),
+        "csv read": lambda: pd.read_csv(csvFile),
+        "snapshot load": lambda: loadSnapshot(csvFile, ["x", "y", "z", "deposition", "escaped", "error"]),
+        "split": lambda: splitFile("siminhale_0.csv", workdir, depositedPath, notDepositedPath),
+        "split multiway": lambda: splitFileMultiway("siminhale_0.csv", workdir),
+        "plot": lambda: plotStage(csvFile, workdir),
+    })
+    return result
+
+def measure(function, repeat):
+    # best wall time of repeat runs, then the peak traced memory of one more run
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+def run(scales, voxelGrid, repeat=3, referenceLimit=100000, seed=0):
+    workdir = tempfile.mkdtemp(prefix="siminhale_benchmark_")
+    rows = []
+    try:
+        for n in scales:
+            df = syntheticCloud(n, seed)
+            for name, function in stages(df, workdir, voxelGrid, referenceLimit).items():
+                try:
+                    seconds, peak = measure(function, repeat)
+                except ImportError as e:
+                    print(f"Skipping {name}: {e}")
+                    continue
+                rows.append({"particles": n, "stage": name, "seconds": seconds, "particles/s": n / seconds,
+                             "peak MB": peak / 2**20})
+                print(f"{n:>10} {name:<24} {seconds:10.4f} s {n / seconds:14.0f} particles/s {peak / 2**20:10.1f} MB")
+    finally:
+        shutil.rmtree(workdir)
+    return pd.DataFrame(rows)
+
+def slowdowns(results, baseline, tolerance):
+    # stages slower than the baseline by more than tolerance
+    merged = results.merge(baseline, on=["particles", "stage"], suffixes=("", " baseline"))
+    merged["slowdown"] = merged["seconds"] / merged["seconds baseline"] - 1
+    return merged[merged["slowdown"] > tolerance][["particles", "stage", "seconds", "seconds baseline", "slowdown"]]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the post-processing stages on synthetic particle clouds")
+    parser.add_argument("--scales", help="comma separated particle counts", default="1e4,1e5,1e6")
+    parser.add_argument("--repeat", help="timed runs per stage, the best is reported", type=int, default=3)
+    parser.add_argument("--referenceLimit", help="largest cloud the row-wise categorise is timed on", type=float, default=1e5)
+    parser.add_argument("--checkSize", help="points the classifiers are checked on", type=float, default=2e4)
+    parser.add_argument("--seed", help="the random seed of the clouds", type=int, default=0)
+    parser.add_argument("--voxelGrid", help="reuse the voxel grid at this path instead of building one", default=None)
+    parser.add_argument("--csv", help="write the results to this csv", default=None)
+    parser.add_argument("--baseline", help="an earlier results csv to compare against", default=None)
+    parser.add_argument("--tolerance", help="allowed slowdown against the baseline, 0.2 -> 20%%", type=float, default=0.2)
+    args = parser.parse_args()
+
+    failed = False
+    gridDirectory = tempfile.mkdtemp(prefix="siminhale_voxels_")
+    try:
+        start = time.perf_counter()
+        voxelGrids = {moreSeg: VoxelGrid(args.voxelGrid if args.voxelGrid and not moreSeg else os.path.join(gridDirectory, f"voxels{int(moreSeg)}"),
+                                         moreSeg=moreSeg) for moreSeg in [False, True]}
+        print("Voxel grids ready: ", round(time.perf_counter() - start, 2), " s")
+        differences = checkClassifiers(syntheticCloud(int(args.checkSize), args.seed + 1), voxelGrids)
+        for name, count in differences.items():
+            print(f"Labels differing from categorise: {name}: {count}")
+            failed |= count > 0
+        differences, copied = checkSnapshots(syntheticCloud(int(args.checkSize), args.seed + 2), gridDirectory)
+        for name, count in differences.items():
+            print(f"Labels differing from categorise: {name}: {count}")
+            failed |= count > 0
+        if copied:
+            print("Sidecar columns copied instead of memory-mapped: ", ", ".join(copied))
+            failed = True
+
+        scales = [int(float(scale)) for scale in args.scales.split(",")]
+        results = run(scales, voxelGrids[False], args.repeat, args.referenceLimit, args.seed)
+    finally:
+        shutil.rmtree(gridDirectory)
+    if args.csv:
+        results.to_csv(args.csv, index=False)
+    if args.baseline:
+        slower = slowdowns(results, pd.read_csv(args.baseline), args.tolerance)
+        if not slower.empty:
+            print("Slower than the baseline:")
+            print(slower.to_string(index=False))
+            failed = True
+    sys.exit(1 if failed else 0)
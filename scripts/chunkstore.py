@@ -0,0 +1,110 @@
+# Content-addressed store for the Solution_*.bin fluid solutions
+# Usage: python chunkstore.py put <files> --store <directory>
+#        python chunkstore.py restore <manifest json> <output directory> --store <directory>
+# Files are cut into fixed-size blocks stored once under chunks/<sha256>, a file is the list of its
+# block hashes. Identical files and identical blocks of different files or runs take no extra space.
+
+import os
+import json
+import uuid
+import argparse
+import hashlib
+from os.path import join, basename
+from concurrent.futures import ThreadPoolExecutor
+
+from artifacts import fileHash
+
+defaultStore = join(os.path.expanduser("~"), ".siminhale", "solutions")
+
+def manifestHash(entries):
+    # one hash of the files of a manifest (names and contents), the same for [{"file", "sha256"}] lists
+    # computed without storing the files
+    files = sorted((entry["file"], entry["sha256"]) for entry in entries)
+    return hashlib.sha256(json.dumps(files).encode()).hexdigest()
+
+class ChunkStore:
+    def __init__(self, root=defaultStore, chunkSize=4 << 20):
+        self.root = root
+        self.chunkSize = chunkSize
+        os.makedirs(join(root, "chunks"), exist_ok=True)
+
+    def chunkPath(self, digest):
+        return join(self.root, "chunks", digest[:2], digest)
+
+    def writeChunk(self, digest, block):
+        # returns the bytes written, 0 if the block is already stored
+        path = self.chunkPath(digest)
+        if os.path.exists(path):
+            return 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmpPath = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmpPath, "wb") as f:
+            f.write(block)
+        # link fails if another thread or process stored the same block meanwhile
+        try:
+            os.link(tmpPath, path)
+            return len(block)
+        except FileExistsError:
+            return 0
+        finally:
+            os.remove(tmpPath)
+
+    def put(self, path):
+        # Store a file, returns its manifest entry and the bytes that were new to the store
+        fileDigest = hashlib.sha256()
+        chunks = []
+        written = 0
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(self.chunkSize), b""):
+                fileDigest.update(block)
+                digest = hashlib.sha256(block).hexdigest()
+                written += self.writeChunk(digest, block)
+                chunks.append(digest)
+        entry = {"file": basename(path), "sha256": fileDigest.hexdigest(), "size": os.path.getsize(path),
+                 "chunkSize": self.chunkSize, "chunks": chunks}
+        return entry, written
+
+    def putFiles(self, paths, workers=4):
+        # returns the manifest of the files and the bytes that were new to the store
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(self.put, paths))
+        return [entry for entry, _ in results], sum(written for _, written in results)
+
+    def restore(self, entry, outputDirectory):
+        digest = hashlib.sha256()
+        path = join(outputDirectory, entry["file"])
+        with open(path + ".tmp", "wb") as f:
+            for chunk in entry["chunks"]:
+                with open(self.chunkPath(chunk), "rb") as c:
+                    block = c.read()
+                digest.update(block)
+                f.write(block)
+        if digest.hexdigest() != entry["sha256"]:
+            os.remove(path + ".tmp")
+            raise ValueError(f"Restored {entry['file']} does not match its hash")
+        os.replace(path + ".tmp", path)
+        return path
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Store solution files by content or restore them from a manifest")
+    parser.add_argument("command", help="put or restore")
+    parser.add_argument("paths", nargs="+", help="put: the files to store, restore: the manifest json and the output directory")
+    parser.add_argument("--store", help="the store directory", default=defaultStore)
+    parser.add_argument("--workers", help="the number of files stored at the same time", type=int, default=4)
+    args = parser.parse_args()
+
+    store = ChunkStore(args.store)
+    if args.command == "put":
+        manifest, written = store.putFiles(args.paths, args.workers)
+        total = sum(entry["size"] for entry in manifest)
+        print(json.dumps(manifest, indent=2))
+        print("Bytes stored: ", written, " of ", total)
+    elif args.command == "restore":
+        manifestFile, outputDirectory = args.paths
+        with open(manifestFile, "r") as f:
+            manifest = json.load(f)
+        os.makedirs(outputDirectory, exist_ok=True)
+        for entry in manifest:
+            print("Restored: ", store.restore(entry, outputDirectory))
+    else:
+        print("Invalid command")
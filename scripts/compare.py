@@ -0,0 +1,119 @@
+# Compares the deposition fractions of many particle runs with the LES/RANS data of the paper
+# Usage: python compare.py <run directories[:diameter]> --diameter <particle diameter> --workers <processes> --output <csv> --summary <csv> --plot <image>
+# Example: python3 compare.py Output/Run_4.3 Output/Run_8:8 --diameter 4.3 --output comparison.csv --plot comparison.png
+# The latest siminhale_<index>.csv of every run is classified in parallel. For each run, reference curve
+# and segment 1-22 the table holds the simulated and the paper fraction, the absolute error and the
+# log10 ratio; the summary has their mean (MAE, RMSE, mean |log10 ratio|) per run and reference curve.
+
+import os
+import argparse
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+from segments import classify, classifyFrame
+from deposition import DepositionCounts
+from snapshots import snapshotFiles, loadSnapshot
+from reference import referenceCurves
+from voxelgrid import VoxelGrid
+
+segments = np.arange(1, 23)
+
+def parseRun(spec, diameter):
+    # "<directory>[:<diameter>]"
+    directory, _, size = spec.rpartition(":") if ":" in spec else (spec, "", "")
+    return directory, float(size) if size else diameter
+
+def runFractions(directory, voxelGrid=None):
+    # deposition fractions of segments 1-22 in the latest snapshot of a run
+    files = snapshotFiles(directory)
+    if not files:
+        raise FileNotFoundError(f"No siminhale_<index>.csv in {directory}")
+    df = loadSnapshot(os.path.join(directory, files[-1]), ["x", "y", "z", "deposition", "escaped", "error"])
+    df["section"] = classifyFrame(df, VoxelGrid(voxelGrid).classify if voxelGrid else classify)
+    counts = DepositionCounts()
+    counts.add(df)
+    return files[-1], counts.fractions(len(segments))
+
+def compare(runs, simulated):
+    # runs: [(directory, diameter)], simulated: (runs x segments) -> per segment table and summary
+    tables = []
+    for (directory, diameter), fractions in zip(runs, simulated):
+        curves = referenceCurves(diameter)
+        if not curves:
+            print(f"No paper data for diameter {diameter}, skipping {directory}")
+            continue
+        names = list(curves)
+        reference = np.stack([curves[name] for name in names])
+        error = fractions[None, :] - reference
+        with np.errstate(divide="ignore", invalid="ignore"):
+            logRatio = np.log10(fractions[None, :] / reference)
+        tables.append(pd.DataFrame({"run": directory, "diameter": diameter,
+                                    "reference": np.repeat(names, len(segments)),
+                                    "segment": np.tile(segments, len(names)),
+                                    "simulated": np.tile(fractions, len(names)),
+                                    "paper": reference.ravel(), "error": error.ravel(),
+                                    "absError": np.abs(error).ravel(), "log10Ratio": logRatio.ravel()}))
+    table = pd.concat(tables, ignore_index=True) if tables else pd.DataFrame()
+    if table.empty:
+        return table, table
+    finite = table.assign(absLog10Ratio=np.abs(table["log10Ratio"].where(np.isfinite(table["log10Ratio"]))),
+                          squaredError=table["error"]**2)
+    summary = finite.groupby(["run", "diameter", "reference"], sort=False).agg(
+        MAE=("absError", "mean"), RMSE=("squaredError", "mean"), meanAbsLog10Ratio=("absLog10Ratio", "mean")).reset_index()
+    summary["RMSE"] = np.sqrt(summary["RMSE"])
+    return table, summary
+
+def plotGrid(runs, simulated, filename, columns=3):
+    # one panel per run with its curve and the paper curves
+    import matplotlib
+    matplotlib.use("Agg")
+    from matplotlib import pyplot as plt
+
+    rows = int(np.ceil(len(runs) / columns))
+    fig, axes = plt.subplots(rows, columns, figsize=(5 * columns, 4 * rows), squeeze=False, sharey=True)
+    for ax, (directory, diameter), fractions in zip(axes.ravel(), runs, simulated):
+        for name, curve in referenceCurves(diameter).items():
+            ax.plot(segments, curve, marker=".", lw=1, label=name)
+        ax.plot(segments, np.where(fractions > 0, fractions, np.nan), marker="x", color="k", label="VMS")
+        ax.set_yscale("log")
+        ax.set_title(f"{os.path.basename(os.path.normpath(directory))} ({diameter} $\\mu m$)", fontsize=10)
+        ax.set_xticks(list(range(1, 23, 2)))
+        ax.grid(alpha=0.5)
+    for ax in axes.ravel()[len(runs):]:
+        ax.axis("off")
+    axes[0, 0].legend(fontsize=8)
+    fig.supxlabel("Segments")
+    fig.supylabel("Deposition fraction (%)")
+    fig.tight_layout()
+    fig.savefig(filename, dpi=150)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the deposition fractions of many runs with the paper data")
+    parser.add_argument("runs", nargs="+", help="the run directories, <directory>:<diameter> overrides --diameter")
+    parser.add_argument("--diameter", help="the particle diameter of the runs", type=float, default=4.3)
+    parser.add_argument("--workers", help="the number of processes", type=int, default=os.cpu_count())
+    parser.add_argument("--voxelGrid", help="classify through the voxel label grid at this path", default=None)
+    parser.add_argument("--output", help="the per segment comparison csv", default="comparison.csv")
+    parser.add_argument("--summary", help="the per run summary csv", default=None)
+    parser.add_argument("--plot", help="write a grid of plots to this file", default=None)
+    args = parser.parse_args()
+
+    runs = [parseRun(spec, args.diameter) for spec in args.runs]
+    if args.voxelGrid:
+        # build it once here instead of in every worker
+        VoxelGrid(args.voxelGrid)
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        results = list(pool.map(runFractions, [directory for directory, _ in runs], [args.voxelGrid] * len(runs)))
+    for (directory, _), (snapshot, _) in zip(runs, results):
+        print(f"{directory}: {snapshot}")
+    simulated = np.stack([fractions for _, fractions in results])
+
+    table, summary = compare(runs, simulated)
+    table.to_csv(args.output, index=False)
+    if args.summary:
+        summary.to_csv(args.summary, index=False)
+    with pd.option_context("display.max_rows", None, "display.width", None):
+        print(summary)
+    if args.plot:
+        plotGrid(runs, simulated, args.plot)
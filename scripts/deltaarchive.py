@@ -0,0 +1,255 @@
+# Archive of snapshot series (Solution_*.bin, VTK files) stored as keyframes and compressed deltas
+# Usage: python deltaarchive.py archive <folder> <archive> --prefix <file prefix> --workers <processes> --keyInterval <snapshots> --watch
+#        python deltaarchive.py extract <archive> <file name> <output directory>
+#        python deltaarchive.py list <archive>
+# Files that differ only by their last number form a series (Solution_u_1.bin, Solution_u_2.bin, ...).
+# Every keyInterval-th snapshot of a series is stored whole, the others as a delta to the previous
+# snapshot, all zlib compressed. Binary .bin files of the same size as the previous one are stored as
+# the byte-wise XOR, which is mostly zeros as consecutive snapshots are nearly equal; their bytes
+# (doubles) are grouped by their position in the value before compressing, which puts the unchanged
+# high bytes together. Text files (csv, ASCII VTK) change length with their values, so they are
+# compared line by line: only the lines that differ from the same line of the previous snapshot are
+# stored (the VTK mesh and the deposited particles stay equal). A snapshot is decoded from the nearest
+# keyframe before it. Snapshots are known by name, size and mtime: a rewritten snapshot replaces its entry
+# and the later ones of its series, and a delta is only taken against a previous file still holding the
+# archived content, otherwise a keyframe is stored.
+
+import os
+import re
+import json
+import time
+import zlib
+import struct
+import hashlib
+import argparse
+import numpy as np
+from os.path import join, basename, exists
+from concurrent.futures import ProcessPoolExecutor
+
+from snapshots import completeSnapshots
+
+def seriesKey(filename):
+    # the file name with its last number replaced by #
+    return re.sub(r"\d+(?=\D*$)", "#", filename)
+
+def seriesStep(filename):
+    numbers = re.findall(r"\d+", filename)
+    return int(numbers[-1]) if numbers else -1
+
+def itemSize(filename):
+    return 8 if filename.endswith(".bin") else 1
+
+def shuffle(payload, size):
+    if size == 1 or len(payload) % size != 0:
+        return payload
+    return np.frombuffer(payload, np.uint8).reshape(-1, size).T.tobytes()
+
+def unshuffle(payload, size):
+    if size == 1 or len(payload) % size != 0:
+        return payload
+    return np.frombuffer(payload, np.uint8).reshape(size, -1).T.tobytes()
+
+def lineDelta(data, previous):
+    # the line count, a bitmap of the lines equal to the previous snapshot's and the other lines
+    lines = data.split(b"\n")
+    previousLines = previous.split(b"\n")
+    equal = np.array([i < len(previousLines) and line == previousLines[i] for i, line in enumerate(lines)], dtype=bool)
+    bitmap = np.packbits(equal).tobytes()
+    changed = b"\n".join(line for line, same in zip(lines, equal) if not same)
+    return struct.pack("<QQ", len(lines), len(bitmap)) + bitmap + changed
+
+def applyLineDelta(payload, previous):
+    count, bitmapSize = struct.unpack_from("<QQ", payload)
+    equal = np.unpackbits(np.frombuffer(payload, np.uint8, bitmapSize, 16), count=count).astype(bool)
+    changed = iter(payload[16 + bitmapSize:].split(b"\n"))
+    previousLines = previous.split(b"\n")
+    return b"\n".join(previousLines[i] if same else next(changed) for i, same in enumerate(equal))
+
+def fileStat(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+def encode(path, previousPath, previousHash, dataPath, level=6):
+    # Compress one snapshot, as a delta to previousPath if given (binaries only if of the same size) and
+    # its content still has previousHash (None: archived in the same batch, not hashed yet)
+    with open(path, "rb") as f:
+        data = f.read()
+    kind = "key"
+    payload = data
+    previous = None
+    if previousPath and (itemSize(path) == 1 or os.path.getsize(previousPath) == len(data)):
+        with open(previousPath, "rb") as f:
+            previous = f.read()
+        if previousHash and hashlib.sha256(previous).hexdigest() != previousHash:
+            previous = None
+    if previous is not None:
+        if itemSize(path) == 1:
+            payload = lineDelta(data, previous)
+            kind = "lines"
+        else:
+            payload = (np.frombuffer(data, np.uint8) ^ np.frombuffer(previous, np.uint8)).tobytes()
+            kind = "delta"
+    compressed = zlib.compress(shuffle(payload, itemSize(path)), level)
+    with open(dataPath + ".tmp", "wb") as f:
+        f.write(compressed)
+    os.replace(dataPath + ".tmp", dataPath)
+    return {"kind": kind, "size": len(data), "stored": len(compressed), "sha256": hashlib.sha256(data).hexdigest()}
+
+class SnapshotArchive:
+    def __init__(self, root, keyInterval=10, level=6, workers=4):
+        self.root = root
+        self.keyInterval = keyInterval
+        self.level = level
+        self.workers = workers
+        self.pool = None
+        # series -> entries ordered by step
+        self.series = {}
+        os.makedirs(root, exist_ok=True)
+        if exists(join(root, "index.json")):
+            with open(join(root, "index.json"), "r") as f:
+                self.series = json.load(f)["series"]
+
+    def saveIndex(self):
+        with open(join(self.root, "index.json.tmp"), "w") as f:
+            json.dump({"keyInterval": self.keyInterval, "series": self.series}, f, indent=1)
+        os.replace(join(self.root, "index.json.tmp"), join(self.root, "index.json"))
+
+    def close(self):
+        if self.pool:
+            self.pool.shutdown()
+            self.pool = None
+
+    def archived(self):
+        # file name -> (size, mtime) of the archived snapshots
+        return {entry["file"]: (entry["size"], entry.get("mtime")) for entries in self.series.values() for entry in entries}
+
+    def add(self, paths):
+        # Compress new or rewritten snapshots in parallel, returns (bytes read, bytes stored)
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        archived = self.archived()
+        paths = {basename(path): path for path in paths if archived.get(basename(path)) != fileStat(path)}
+        # a rewritten snapshot replaces its entry and the later entries of the series (deltas to it),
+        # which are encoded again from their sources
+        for name in list(paths):
+            entries = self.series.get(seriesKey(name), [])
+            position = next((i for i, entry in enumerate(entries) if entry["file"] == name), None)
+            if position is None:
+                continue
+            for entry in entries[position:]:
+                if exists(entry["source"]):
+                    paths.setdefault(entry["file"], entry["source"])
+                else:
+                    print(f"Dropped {entry['file']} from the archive, it follows the rewritten {name} and its source is gone")
+            del entries[position:]
+        jobs = []
+        for path in sorted(paths.values(), key=lambda p: (seriesKey(basename(p)), seriesStep(basename(p)))):
+            name = basename(path)
+            entries = self.series.setdefault(seriesKey(name), [])
+            if entries and seriesStep(name) <= entries[-1]["step"]:
+                raise ValueError(f"{name} is older than the last archived snapshot of its series")
+            sinceKey = next((i for i, entry in enumerate(reversed(entries)) if entry["kind"] == "key"), len(entries))
+            # the delta is taken against the previous source file, which must still exist
+            previousPath = entries[-1]["source"] if entries and sinceKey + 1 < self.keyInterval else None
+            if previousPath and not exists(previousPath):
+                previousPath = None
+            entry = {"file": name, "step": seriesStep(name), "data": name + ".z", "source": os.path.abspath(path),
+                     "mtime": fileStat(path)[1], "kind": "delta" if previousPath else "key"}
+            previousHash = entries[-1].get("sha256") if previousPath else None
+            entries.append(entry)
+            jobs.append((entry, self.pool.submit(encode, path, previousPath, previousHash, join(self.root, entry["data"]), self.level)))
+        for entry, future in jobs:
+            entry.update(future.result())
+        self.saveIndex()
+        return sum(entry["size"] for entry, _ in jobs), sum(entry["stored"] for entry, _ in jobs)
+
+    def read(self, filename):
+        # The content of an archived snapshot, decoded from the nearest keyframe
+        entries = self.series[seriesKey(filename)]
+        position = next(i for i, entry in enumerate(entries) if entry["file"] == filename)
+        start = max(i for i in range(position + 1) if entries[i]["kind"] == "key")
+        data = None
+        for entry in entries[start:position + 1]:
+            with open(join(self.root, entry["data"]), "rb") as f:
+                payload = unshuffle(zlib.decompress(f.read()), itemSize(filename))
+            if entry["kind"] == "key":
+                data = payload
+            elif entry["kind"] == "lines":
+                data = applyLineDelta(payload, data)
+            else:
+                data = (np.frombuffer(data, np.uint8) ^ np.frombuffer(payload, np.uint8)).tobytes()
+        if hashlib.sha256(data).hexdigest() != entries[position]["sha256"]:
+            raise ValueError(f"Decoded {filename} does not match its hash")
+        return data
+
+    def extract(self, filename, outputDirectory):
+        os.makedirs(outputDirectory, exist_ok=True)
+        path = join(outputDirectory, filename)
+        with open(path, "wb") as f:
+            f.write(self.read(filename))
+        return path
+
+    def files(self):
+        # the archive's own files, for uploading
+        return [join(self.root, "index.json")] + [join(self.root, entry["data"]) for entries in self.series.values() for entry in entries]
+
+def pendingFiles(archive, path, settle, prefix=""):
+    # the complete snapshots of every series in the folder not archived yet or rewritten since
+    archived = archive.archived()
+    series = {}
+    for name in os.listdir(path):
+        if (name.startswith(prefix) and os.path.isfile(join(path, name)) and not name.endswith(".tmp")
+                and archived.get(name) != fileStat(join(path, name))):
+            series.setdefault(seriesKey(name), []).append(name)
+    files = []
+    for names in series.values():
+        files += completeSnapshots(path, sorted(names, key=seriesStep), settle)
+    return [join(path, name) for name in files]
+
+def watch(archive, path, prefix="", interval=10, settle=5, idleTimeout=None):
+    # Archive the snapshots while the solver writes them
+    idle = 0
+    while idleTimeout is None or idle < idleTimeout:
+        files = pendingFiles(archive, path, settle, prefix)
+        if files:
+            read, stored = archive.add(files)
+            print(f"Archived {len(files)} snapshots: {read} bytes -> {stored} bytes")
+        idle = 0 if files else idle + interval
+        time.sleep(interval)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archive snapshot series as keyframes and compressed deltas")
+    parser.add_argument("command", help="archive, extract or list")
+    parser.add_argument("paths", nargs="+", help="archive: <folder> <archive>, extract: <archive> <file name> <output directory>, list: <archive>")
+    parser.add_argument("--prefix", help="only archive the files starting with this, e.g. Solution_", default="")
+    parser.add_argument("--workers", help="the number of compression processes", type=int, default=4)
+    parser.add_argument("--keyInterval", help="every n-th snapshot of a series is stored whole", type=int, default=10)
+    parser.add_argument("--level", help="the zlib compression level", type=int, default=6)
+    parser.add_argument("--watch", help="keep archiving while the solver writes", action="store_true")
+    parser.add_argument("--interval", help="seconds between two looks at the folder", type=float, default=10)
+    parser.add_argument("--settle", help="seconds the newest snapshot must be unchanged to count as complete", type=float, default=5)
+    parser.add_argument("--idleTimeout", help="stop watching after this many seconds without a new snapshot", type=float, default=None)
+    args = parser.parse_args()
+
+    if args.command == "archive":
+        path, root = args.paths
+        archive = SnapshotArchive(root, args.keyInterval, args.level, args.workers)
+        try:
+            if args.watch:
+                watch(archive, path, args.prefix, args.interval, args.settle, args.idleTimeout)
+            else:
+                read, stored = archive.add(pendingFiles(archive, path, 0, args.prefix))
+                print("Archived: ", read, " bytes -> ", stored, " bytes")
+        except KeyboardInterrupt:
+            print("Stopped archiving")
+        finally:
+            archive.close()
+    elif args.command == "extract":
+        root, filename, outputDirectory = args.paths
+        print("Extracted: ", SnapshotArchive(root).extract(filename, outputDirectory))
+    elif args.command == "list":
+        for key, entries in SnapshotArchive(args.paths[0]).series.items():
+            print(key, ": ", len(entries), " snapshots, ", sum(e["kind"] == "key" for e in entries), " keyframes, ",
+                  sum(e["size"] for e in entries), " bytes -> ", sum(e["stored"] for e in entries), " bytes")
+    else:
+        print("Invalid command")
@@ -0,0 +1,129 @@
+# Running deposition counters, filled one frame (or csv chunk) at a time
+
+import hashlib
+import numpy as np
+import pandas as pd
+
+def bootstrapFractions(sections, replicates=2000, level=0.95, seed=None):
+    # Confidence interval (low, high) of the deposition fraction (%) of every section, shaped like sections.
+    # The deposited particles are redrawn over the sections as multinomial samples of the observed counts.
+    # Without a seed it is derived from the counts, so the same data always gives the same intervals.
+    sections = np.asarray(sections, dtype=np.int64)
+    if seed is None:
+        seed = int.from_bytes(hashlib.sha256(sections.tobytes()).digest()[:8], "little")
+    deposited = sections.sum(axis=-1, keepdims=True)
+    probabilities = sections / np.maximum(deposited, 1)
+    draws = np.random.default_rng(seed).multinomial(deposited[..., 0], probabilities, size=(replicates,) + sections.shape[:-1])
+    fractions = draws / np.maximum(deposited, 1) * 100
+    low, high = np.percentile(fractions, [50 * (1 - level), 50 * (1 + level)], axis=0)
+    return low, high
+
+class DepositionCounts:
+    def __init__(self, segments=32):
+        self.total = 0
+        self.escaped = 0
+        self.stagnant = 0
+        self.error = 0
+        # deposited particles per section, index section + 1 so that -1 (unclassified) is 0
+        self.sections = np.zeros(segments + 2, dtype=np.int64)
+
+    @property
+    def deposited(self):
+        return int(self.sections.sum())
+
+    def add(self, df):
+        self.addArrays(df['section'].to_numpy(), df['deposition'].to_numpy(),
+                       df['escaped'].to_numpy(), df['error'].to_numpy())
+
+    def addArrays(self, section, deposition, escaped, error):
+        deposited = (deposition == 1) & (escaped == 0)
+        self.sections += np.bincount(section[deposited] + 1, minlength=len(self.sections))[:len(self.sections)]
+        self.total += len(section)
+        self.escaped += int(np.count_nonzero(escaped == 1))
+        self.stagnant += int(np.count_nonzero(deposition == 0))
+        self.error += int(np.count_nonzero(error == 1))
+
+    def merge(self, other):
+        self.total += other.total
+        self.escaped += other.escaped
+        self.stagnant += other.stagnant
+        self.error += other.error
+        self.sections += other.sections
+
+    def grouped(self):
+        # Same table as grouping the deposited particles by section, without the -1 row
+        present = np.flatnonzero(self.sections)
+        df_grouped = pd.DataFrame({'section': present - 1, 'count': self.sections[present]})
+        df_grouped = df_grouped[df_grouped['section'] != -1]
+        df_grouped['Deposition fraction'] = (df_grouped['count'] / self.deposited) * 100
+        return df_grouped
+
+    def fractions(self, segments=22):
+        # Deposition fraction (%) of sections 1..segments as an array
+        return self.sections[2:segments + 2] / max(self.deposited, 1) * 100
+
+    def intervals(self, replicates=2000, level=0.95, seed=None):
+        # (low, high) of the deposition fraction (%) per section, indexed like sections
+        return bootstrapFractions(self.sections, replicates, level, seed)
+
+    def summary(self):
+        # Plain python values of the counters and the table, for json status files
+        df_grouped = self.grouped()
+        return {"total": self.total, "deposited": self.deposited, "escaped": self.escaped,
+                "stagnant": self.stagnant, "error": self.error,
+                "sections": [{"section": int(section), "count": int(count), "fraction": float(fraction)}
+                             for section, count, fraction in df_grouped.itertuples(index=False)]}
+
+    def printSummary(self):
+        particles = self.deposited
+        print("Total particles: ", self.total)
+        print("Total deposited: ", particles)
+        print("Deposition percentage: ", particles / self.total * 100)
+        print("Total escaped: ", self.escaped)
+        print("Escape percentage: ", self.escaped / self.total * 100)
+        print("Total stagnant: ", self.stagnant)
+        print("Stagnant percentage: ", self.stagnant / self.total * 100)
+        print("Total error: ", self.error)
+        print("Error percentage: ", self.error / self.total * 100)
+        print(self.grouped())
+
+class BinnedCounts:
+    # Deposited particles per particle diameter bin and section, filled one frame at a time
+    def __init__(self, edges, segments=32):
+        self.edges = np.asarray(edges, dtype=np.float64)
+        bins = len(self.edges) - 1
+        self.total = np.zeros(bins, dtype=np.int64)
+        # index section + 1 like DepositionCounts
+        self.sections = np.zeros((bins, segments + 2), dtype=np.int64)
+
+    def add(self, df, column="diameter"):
+        self.addArrays(df['section'].to_numpy(), df[column].to_numpy(), df['deposition'].to_numpy(), df['escaped'].to_numpy())
+
+    def addArrays(self, section, diameter, deposition, escaped):
+        # particles outside the bin edges are not counted
+        bins, width = self.sections.shape
+        binIndex = np.searchsorted(self.edges, diameter, side="right") - 1
+        inBins = (binIndex >= 0) & (binIndex < bins)
+        self.total += np.bincount(binIndex[inBins], minlength=bins)
+        deposited = inBins & (deposition == 1) & (escaped == 0)
+        cells = binIndex[deposited] * width + np.clip(section[deposited] + 1, 0, width - 1)
+        self.sections += np.bincount(cells, minlength=bins * width).reshape(bins, width)
+
+    def merge(self, other):
+        self.total += other.total
+        self.sections += other.sections
+
+    @property
+    def deposited(self):
+        return self.sections.sum(axis=1)
+
+    def fractions(self, segments=22):
+        # Deposition fraction (%) of sections 1..segments, one row per bin
+        return self.sections[:, 2:segments + 2] / np.maximum(self.deposited, 1)[:, None] * 100
+
+    def intervals(self, replicates=2000, level=0.95, seed=None):
+        # (low, high) of the deposition fraction (%) per bin and section, indexed like sections
+        return bootstrapFractions(self.sections, replicates, level, seed)
+
+    def labels(self):
+        return [f"{low:g}-{high:g}" for low, high in zip(self.edges[:-1], self.edges[1:])]
@@ -0,0 +1,164 @@
+# Incremental deposition analysis over the siminhale_<index>.csv snapshot series
+# Usage: python incremental.py <folder containing particles csv> --checkpoint <state file> --timeline <csv> --moreSegments
+#        python incremental.py <folder containing particles csv> --watch --status <json file> --interval <seconds>
+# Deposited particles do not move again, so only the particles whose deposition flag changed since the
+# previous snapshot are classified. The per-particle state is saved in the checkpoint (default
+# <folder>/deposition_state.npz), a re-run only reads the snapshots written since.
+# --watch keeps following the folder while the solver writes and keeps the status file up to date.
+
+import os
+import json
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+from datetime import datetime
+
+from segments import classify, geometryVersion
+from deposition import DepositionCounts
+from snapshots import snapshotFiles, snapshotIndex, loadSnapshot, completeSnapshots
+
+columns = ["x", "y", "z", "deposition", "escaped", "error"]
+
+class DepositionState:
+    # Particles are identified by their row in the snapshots
+    def __init__(self, checkpoint=None, moreSeg=False):
+        self.checkpoint = checkpoint
+        self.moreSeg = moreSeg
+        self.version = geometryVersion()
+        self.lastIndex = -1
+        self.deposition = np.zeros(0, dtype=np.int8)
+        self.escaped = np.zeros(0, dtype=np.int8)
+        self.error = np.zeros(0, dtype=np.int8)
+        # section and snapshot index of the deposition, -1 while a particle is not deposited
+        self.section = np.zeros(0, dtype=np.int8)
+        self.depositionStep = np.zeros(0, dtype=np.int64)
+        if checkpoint and os.path.exists(checkpoint):
+            self.load()
+
+    def load(self):
+        with np.load(self.checkpoint) as state:
+            if str(state["version"]) != self.version or bool(state["moreSeg"]) != self.moreSeg:
+                print("Checkpoint was written for another segment geometry, starting over")
+                return
+            self.lastIndex = int(state["lastIndex"])
+            self.deposition = state["deposition"]
+            self.escaped = state["escaped"]
+            self.error = state["error"]
+            self.section = state["section"]
+            self.depositionStep = state["depositionStep"]
+
+    def save(self):
+        tmpPath = self.checkpoint + ".tmp"
+        with open(tmpPath, "wb") as f:
+            np.savez(f, version=self.version, moreSeg=self.moreSeg, lastIndex=self.lastIndex,
+                     deposition=self.deposition, escaped=self.escaped, error=self.error,
+                     section=self.section, depositionStep=self.depositionStep)
+        os.replace(tmpPath, self.checkpoint)
+
+    def resize(self, particles):
+        known = len(self.deposition)
+        if particles < known:
+            raise ValueError(f"Snapshot has {particles} particles, {known} were tracked before")
+        grow = particles - known
+        self.deposition = np.append(self.deposition, np.zeros(grow, dtype=np.int8))
+        self.escaped = np.append(self.escaped, np.zeros(grow, dtype=np.int8))
+        self.error = np.append(self.error, np.zeros(grow, dtype=np.int8))
+        self.section = np.append(self.section, np.full(grow, -1, dtype=np.int8))
+        self.depositionStep = np.append(self.depositionStep, np.full(grow, -1, dtype=np.int64))
+
+    def update(self, df, index):
+        # Apply one snapshot, returns the number of newly deposited particles
+        self.resize(df.shape[0])
+        deposition = df["deposition"].to_numpy().astype(np.int8)
+        changed = np.flatnonzero(deposition != self.deposition)
+
+        new = changed[deposition[changed] == 1]
+        if len(new) > 0:
+            self.section[new] = classify(df["x"].to_numpy()[new], df["y"].to_numpy()[new],
+                                         df["z"].to_numpy()[new], self.moreSeg)
+            self.depositionStep[new] = index
+        cleared = changed[deposition[changed] != 1]
+        self.section[cleared] = -1
+        self.depositionStep[cleared] = -1
+
+        self.deposition = deposition
+        self.escaped = df["escaped"].to_numpy().astype(np.int8)
+        self.error = df["error"].to_numpy().astype(np.int8)
+        self.lastIndex = index
+        return len(new)
+
+    def pending(self, path):
+        return [f for f in snapshotFiles(path) if snapshotIndex(f) > self.lastIndex]
+
+    def process(self, path):
+        # Apply every snapshot written since the last run, returns the number of files read
+        files = self.pending(path)
+        for i in tqdm(range(len(files))):
+            self.update(loadSnapshot(os.path.join(path, files[i]), columns, sidecar=False), snapshotIndex(files[i]))
+        if self.checkpoint and len(files) > 0:
+            self.save()
+        return len(files)
+
+    def counts(self):
+        counts = DepositionCounts()
+        counts.addArrays(self.section.astype(np.int64), self.deposition, self.escaped, self.error)
+        return counts
+
+    def timeline(self):
+        # Newly and cumulatively deposited particles per snapshot index
+        steps, newlyDeposited = np.unique(self.depositionStep[self.depositionStep >= 0], return_counts=True)
+        return pd.DataFrame({"index": steps, "deposited": newlyDeposited, "total": np.cumsum(newlyDeposited)})
+
+def writeStatus(state, statusFile):
+    status = {"lastIndex": state.lastIndex, "updated": datetime.now().isoformat(timespec="seconds")}
+    status.update(state.counts().summary())
+    with open(statusFile + ".tmp", "w") as f:
+        json.dump(status, f, indent=2)
+    os.replace(statusFile + ".tmp", statusFile)
+
+def watch(state, path, statusFile, interval=10, settle=5, idleTimeout=None):
+    # Process the snapshots as the solver writes them, until nothing new arrives for idleTimeout seconds
+    idle = 0
+    writeStatus(state, statusFile)
+    while idleTimeout is None or idle < idleTimeout:
+        files = completeSnapshots(path, state.pending(path), settle)
+        for filename in files:
+            index = snapshotIndex(filename)
+            newlyDeposited = state.update(loadSnapshot(os.path.join(path, filename), columns, sidecar=False), index)
+            if state.checkpoint:
+                state.save()
+            writeStatus(state, statusFile)
+            print(f"Snapshot {index}: {newlyDeposited} newly deposited, {state.counts().deposited} in total")
+        idle = 0 if files else idle + interval
+        time.sleep(interval)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Incrementally track the deposition over the particle snapshots")
+    parser.add_argument("path", nargs="?", help="the folder containing the particle csv files", default=".")
+    parser.add_argument("--checkpoint", help="the state file, default is <path>/deposition_state.npz", default=None)
+    parser.add_argument("--timeline", help="write the deposited particles per snapshot to this csv", default=None)
+    parser.add_argument("--moreSegments", help="split the generation 13-22 segments into 23-32", action="store_true")
+    parser.add_argument("--watch", help="keep following the folder while the solver writes", action="store_true")
+    parser.add_argument("--status", help="the json status file of the watch mode, default is <path>/deposition_status.json", default=None)
+    parser.add_argument("--interval", help="seconds between two looks at the folder", type=float, default=10)
+    parser.add_argument("--settle", help="seconds the newest snapshot must be unchanged to count as complete", type=float, default=5)
+    parser.add_argument("--idleTimeout", help="stop watching after this many seconds without a new snapshot", type=float, default=None)
+    args = parser.parse_args()
+
+    checkpoint = args.checkpoint or os.path.join(args.path, "deposition_state.npz")
+    state = DepositionState(checkpoint, args.moreSegments)
+    print("Last processed snapshot: ", state.lastIndex)
+    if args.watch:
+        statusFile = args.status or os.path.join(args.path, "deposition_status.json")
+        print("Status file: ", statusFile)
+        try:
+            watch(state, args.path, statusFile, args.interval, args.settle, args.idleTimeout)
+        except KeyboardInterrupt:
+            print("Stopped watching at snapshot ", state.lastIndex)
+    else:
+        print("New snapshots: ", state.process(args.path))
+    state.counts().printSummary()
+    if args.timeline:
+        state.timeline().to_csv(args.timeline, index=False)
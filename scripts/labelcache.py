@@ -0,0 +1,142 @@
+# Persistent cache of the section labels and deposition counts of classified snapshots
+# An entry is keyed by the sha256 of the snapshot file, the classifier and geometryVersion(), so a
+# changed snapshot or an edit of the segment tables or the classification rules never hits an old entry.
+# An entry is <key>.labels (raw int8 labels, memory-mapped when read, appended chunk by chunk when
+# written) and <key>.json (the counts, written last so a present json means a complete entry). A hit
+# refreshes the json's mtime and the least recently used entries are deleted once the cache is larger
+# than maxBytes.
+
+import os
+import json
+import hashlib
+import numpy as np
+from os.path import join
+
+from segments import geometryVersion
+from artifacts import fileHash
+from deposition import DepositionCounts
+
+defaultCache = join(os.path.expanduser("~"), ".siminhale", "labels")
+
+class LabelWriter:
+    # Writes the labels of one entry chunk by chunk, commit() completes the entry. A failing write
+    # (e.g. a full disk) is reported once and the entry is dropped, the caller's work goes on.
+    def __init__(self, cache, key):
+        self.cache = cache
+        self.key = key
+        self.tmpPath = cache.labelsPath(key) + f".{os.getpid()}.tmp"
+        self.file = None
+        self.attempt(lambda: setattr(self, "file", open(self.tmpPath, "wb")))
+
+    def attempt(self, action):
+        try:
+            action()
+        except OSError as e:
+            print(f"Could not cache the labels: {e}")
+            self.close()
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+        if os.path.exists(self.tmpPath):
+            os.remove(self.tmpPath)
+
+    def write(self, labels):
+        if self.file:
+            self.attempt(lambda: self.file.write(np.asarray(labels, dtype=np.int8).tobytes()))
+
+    def commit(self, counts):
+        if not self.file:
+            return
+        self.file.close()
+        self.file = None
+        meta = {"sections": counts.sections.tolist(), "total": counts.total, "escaped": counts.escaped,
+                "stagnant": counts.stagnant, "error": counts.error}
+
+        def store():
+            with open(self.cache.countsPath(self.key) + ".tmp", "w") as f:
+                json.dump(meta, f)
+            os.replace(self.tmpPath, self.cache.labelsPath(self.key))
+            os.replace(self.cache.countsPath(self.key) + ".tmp", self.cache.countsPath(self.key))
+        self.attempt(store)
+        self.cache.evict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class LabelCache:
+    def __init__(self, root=defaultCache, maxBytes=1 << 30):
+        self.root = root
+        self.maxBytes = maxBytes
+        os.makedirs(root, exist_ok=True)
+
+    def key(self, filename, classifier):
+        # classifier: a name for the labelling, e.g. "classify moreSegments" or "boxes"
+        text = f"{fileHash(filename)}:{classifier}:{geometryVersion()}"
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def labelsPath(self, key):
+        return join(self.root, key + ".labels")
+
+    def countsPath(self, key):
+        return join(self.root, key + ".json")
+
+    def counts(self, key):
+        # the DepositionCounts of an entry or None, the labels are not read
+        try:
+            with open(self.countsPath(key), "r") as f:
+                meta = json.load(f)
+            if not os.path.exists(self.labelsPath(key)):
+                return None
+        except (OSError, ValueError):
+            return None
+        counts = DepositionCounts(len(meta["sections"]) - 2)
+        counts.sections[:] = meta["sections"]
+        counts.total, counts.escaped, counts.stagnant = meta["total"], meta["escaped"], meta["stagnant"]
+        counts.error = meta["error"]
+        os.utime(self.countsPath(key))
+        return counts
+
+    def labels(self, key):
+        # the labels of an entry memory-mapped (int8), or None
+        try:
+            if os.path.getsize(self.labelsPath(key)) == 0:
+                return np.zeros(0, dtype=np.int8)
+            return np.memmap(self.labelsPath(key), dtype=np.int8, mode="r")
+        except OSError:
+            return None
+
+    def writer(self, key):
+        return LabelWriter(self, key)
+
+    def put(self, key, labels, counts):
+        with self.writer(key) as writer:
+            writer.write(labels)
+            writer.commit(counts)
+
+    def evict(self):
+        # delete the least recently used entries until the cache fits in maxBytes
+        entries = []
+        for name in os.listdir(self.root):
+            if name.endswith(".json"):
+                key = name[:-len(".json")]
+                try:
+                    stat = os.stat(join(self.root, name))
+                    size = stat.st_size + os.path.getsize(self.labelsPath(key))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime_ns, size, key))
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in sorted(entries):
+            if total <= self.maxBytes:
+                break
+            for path in [self.countsPath(key), self.labelsPath(key)]:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            total -= size
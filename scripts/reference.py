@@ -0,0 +1,69 @@
+# Deposition fractions (%) of segments 1-22 from the paper, per particle diameter (in micrometers)
+# les1/les2/rans1/rans3 -> monodisperse particles, poly -> 0.5 polydisperse particles
+
+import numpy as np
+
+def les1(size=4.3):
+    if size == 2.5:
+        return [1.383, 0.162, 0.281, 0.077, 0.355, 0.206, 0.180, 0.330, 0.285, 0.246, 0.623, 0.289, 0.090, 0.121, 0.400, 0.272, 0.492, 0.361, 0.355, 0.642, 0.928, 0.412]
+    if size == 4.3:
+        return [3.113, 0.454, 0.749, 0.295, 1.695, 1.347, 1.259, 0.972, 1.280, 1.079, 3.840, 2.167, 0.257, 0.651, 1.829, 1.291, 2.654, 1.686, 4.334, 4.634, 2.537, 4.704]
+    if size == 8:
+        return [22.495, 4.569, 5.376, 3.664, 4.706, 2.848, 1.602, 6.231, 3.502, 5.142, 7.768, 4.992, 0.167, 0.082, 6.044, 1.361, 1.554, 6.900, 4.991, 2.385, 1.381, 1.123]
+    if size == 10:
+        return [42.115, 8.121, 6.752, 4.776, 2.232, 1.488, 0.446, 5.784, 1.613, 4.180, 4.272, 2.492, 0.023, 0.005, 2.264, 0.297, 0.192, 3.767, 1.131, 0.272, 0.156, 0.076]
+
+def les2(size=4.3):
+    if size == 2.5:
+        return [12.478, 3.354, 1.092, 0.478, 0.901, 1.060, 0.766, 0.744, 0.862, 0.801, 1.404, 1.247, 0.888, 0.813, 4.064, 2.122, 2.571, 2.810, 3.354, 2.154, 2.285, 2.353]
+    if size == 4.3:
+        return [17.977, 5.771, 1.797, 0.849, 1.376, 1.841, 1.507, 1.368, 1.747, 1.660, 3.122, 2.834, 0.857, 0.733, 7.614, 3.547, 3.960, 6.137, 7.182, 3.707, 4.274, 4.637]
+    if size == 8:
+        return [37.706, 10.597, 2.978, 2.726, 2.645, 1.750, 0.999, 4.371, 2.316, 4.183, 6.048, 3.402, 0.218, 0.004, 4.917, 1.321, 1.600, 6.412, 4.115, 1.227, 0.998, 0.998]
+    if size == 10:
+        return [48.105, 9.008, 3.854, 3.205, 1.567, 0.812, 0.295, 5.217, 1.166, 4.057, 4.336, 2.567, 0.013, 0.001, 2.073, 0.306, 0.291, 3.603, 0.893, 0.144, 0.123, 0.026]
+
+def rans1(size=4.3):
+    if size == 2.5:
+        return [18.460, 6.385, 1.178, 1.161, 1.015, 1.061, 0.601, 1.589, 1.127, 1.389, 1.873, 1.368, 0.510, 0.517, 2.526, 1.030, 1.791, 2.310, 2.310, 1.818, 1.368, 1.738]
+    if size == 4.3:
+        return [20.087, 7.173, 1.506, 1.534, 1.328, 1.765, 0.885, 1.831, 1.409, 1.928, 3.059, 2.123, 0.548, 0.403, 2.970, 1.285, 2.227, 3.234, 3.293, 2.219, 1.540, 2.630]
+    if size == 8:
+        return [25.332, 7.774, 3.308, 3.983, 2.982, 2.299, 1.053, 4.103, 1.996, 4.356, 4.387, 5.204, 0.311, 0.165, 5.321, 1.093, 1.259, 7.005, 3.117, 1.287, 0.843, 1.952]
+    if size == 10:
+        return [34.614, 7.092, 4.738, 5.420, 2.275, 1.960, 0.558, 4.528, 1.178, 4.331, 2.642, 5.257, 0.099, 0.104, 3.358, 0.378, 0.302, 5.927, 1.214, 0.272, 0.168, 0.502]
+
+def rans3(size=4.3):
+    if size == 2.5:
+        return [1.475, 0.123, 0.103, 0.049, 0.109, 0.073, 0.039, 0.176, 0.112, 0.114, 0.128, 0.071, 0.054, 0.053, 0.211, 0.132, 0.163, 0.136, 0.190, 0.284, 0.231, 0.204]
+    if size == 4.3:
+        return [2.992, 0.503, 0.462, 0.307, 0.878, 0.869, 0.967, 0.722, 1.146, 1.117, 1.646, 1.030, 0.186, 0.397, 1.670, 1.425, 1.452, 1.133, 2.054, 2.123, 1.866, 1.845]
+    if size == 8:
+        return [7.271, 1.177, 1.317, 0.971, 1.720, 1.562, 1.356, 1.366, 1.882, 1.516, 4.519, 4.104, 0.635, 0.721, 3.616, 2.512, 2.727, 2.299, 3.725, 3.187, 2.768, 2.830]
+    if size == 10:
+        return [14.112, 2.275, 2.346, 2.144, 3.958, 2.763, 1.989, 1.765, 2.208, 1.791, 6.580, 5.420, 0.887, 0.887, 4.017, 3.069, 2.526, 2.311, 3.459, 2.979, 2.490, 2.310]
+    
+def paperDf(size=4.3):
+    size = float(size)
+    return les1(size), les2(size), rans1(size), rans3(size)
+
+
+# 0.5 polydisperse paper data
+poly = {}
+poly["median"] = [2872.984833, 992.0367886, 329.1251811, 299.0160116, 265.222956, 218.9161379, 210.3374801, 737.9986299, 303.8357614, 326.5042877, 514.9980155, 287.2984833, 157.7308583, 359.3813664, 540.3048785, 365.1741273, 395.5689752, 395.5689752, 575.9922854, 644.2104683, 408.4238653, 386.1940297]
+poly["mean"] = [2120.258871, 599.4842503, 301.416253, 218.9161379, 220.6734069, 183.6068538, 177.827941, 549.0138914, 250.7873091, 273.8419634, 377.0412694, 210.3374801, 104.0785208, 121.1527659, 194.1755055, 213.7278471, 164.1639442, 164.1639442, 506.8285968, 359.3813664, 235.2489955, 197.3053625]
+poly["max"] = [3622.661685, 2103.374801, 438.8954829, 389.2940606, 992.0367886, 2004.856687, 278.2559402, 2468.090675, 398.7442601, 380.0678299, 793.059105, 415.0071275, 859.0684664, 540.3048785, 1281.264782, 467.8847485, 692.2736124, 901.2828581, 726.2917502, 901.2828581, 618.9658189, 649.3816316]
+
+referenceSizes = [2.5, 4.3, 8, 10]
+
+def referenceCurves(size=4.3):
+    # name -> fractions of segments 1-22, empty if the paper has no data for the size
+    size = float(size)
+    if size not in referenceSizes:
+        return {}
+    return {name: np.array(curve(size)) for name, curve in [("LES1", les1), ("LES2", les2), ("RANS1", rans1), ("RANS3", rans3)]}
+
+def binReferenceSize(low, high):
+    # the paper diameter inside [low, high), the one closest to the bin center if several, None if none
+    sizes = [size for size in referenceSizes if low <= size < high]
+    return min(sizes, key=lambda size: abs(size - (low + high) / 2)) if sizes else None
@@ -0,0 +1,110 @@
+# Figure rendering for the deposition plots, without the global pyplot state
+# A figure is described by a plain dict (the spec: labels, scales, ticks and the data series), so it can
+# be hashed and drawn in other processes. saveFigure writes every format in its own process and keeps
+# the files in a cache keyed by the hash of the spec, the style and the format: a plot of unchanged data
+# is copied from the cache instead of being drawn again.
+# Styles: "mathtext" renders the labels with matplotlib itself, "latex" runs LaTeX like the paper figures.
+
+import os
+import json
+import shutil
+import hashlib
+from os.path import join
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+from matplotlib.figure import Figure
+from cycler import cycler
+
+defaultCache = join(os.path.expanduser("~"), ".siminhale", "figures")
+
+colors = ['darkblue', '#d62728', '#2ca02c', '#ff7f0e', '#bcbd22', '#8c564b', '#17becf', '#9467bd', '#e377c2', '#7f7f7f']
+
+baseStyle = {
+    "font.family": "serif",
+    "xtick.labelsize": 20,
+    "axes.titlesize": 20,
+    "axes.labelsize": 20,
+    "legend.fontsize": 20,
+    "ytick.labelsize": 20,
+    "axes.prop_cycle": cycler(color=colors),
+}
+
+styles = {
+    "mathtext": dict(baseStyle, **{"mathtext.fontset": "cm", "font.serif": ["DejaVu Serif"], "axes.formatter.use_mathtext": True}),
+    "latex": dict(baseStyle, **{"text.usetex": True, "font.serif": ["Computer Modern"]}),
+    # the matplotlib defaults, as track.py always used
+    "plain": {},
+}
+
+def percent(style):
+    # a literal % sign in a label
+    return "\\%" if style == "latex" else "%"
+
+def drawFigure(spec, fig):
+    # Draw the spec onto a matplotlib figure
+    ax = fig.add_subplot(1, 1, 1)
+    for series in spec["series"]:
+        if series.get("yerr") is not None:
+            # yerr: [distances below, distances above]
+            ax.errorbar(series["x"], series["y"], yerr=series["yerr"], marker=series.get("marker", "x"), label=series.get("label"), capsize=3)
+            continue
+        draw = ax.scatter if series.get("type") == "scatter" else ax.plot
+        draw(series["x"], series["y"], marker=series.get("marker", "x"), label=series.get("label"))
+    ax.set_xlabel(spec.get("xlabel", ""))
+    ax.set_ylabel(spec.get("ylabel", ""))
+    if spec.get("yscale"):
+        ax.set_yscale(spec["yscale"])
+    if spec.get("title"):
+        ax.set_title(spec["title"])
+    if spec.get("xticks") is not None:
+        ax.set_xticks(spec["xticks"])
+    if spec.get("yticks") is not None:
+        ax.set_yticks(spec["yticks"])
+    if spec.get("legend"):
+        ax.legend(**spec["legend"])
+    if spec.get("grid"):
+        ax.grid(alpha=spec["grid"])
+    if spec.get("tightLayout"):
+        fig.tight_layout()
+    return fig
+
+def renderFile(spec, style, filename):
+    # one format, on a figure of its own
+    with matplotlib.rc_context(styles[style]):
+        fig = Figure(figsize=spec.get("figsize", (6.4, 4.8)))
+        drawFigure(spec, fig)
+        fig.savefig(filename, dpi=spec.get("dpi", 300))
+    return filename
+
+def specHash(spec, style, extension):
+    text = json.dumps({"spec": spec, "style": style, "extension": extension}, sort_keys=True, default=float)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+def saveFigure(spec, targetFile, extensions, style="mathtext", cache=defaultCache, workers=None):
+    # Write targetFile + ext for every extension, returns the file names
+    files = [targetFile + ext for ext in extensions]
+    missing = []
+    for ext, filename in zip(extensions, files):
+        cached = join(cache, specHash(spec, style, ext) + "." + ext) if cache else None
+        if cached and os.path.exists(cached):
+            shutil.copyfile(cached, filename)
+        else:
+            missing.append((filename, cached))
+
+    # matplotlib is imported already, so forked workers start quickly; one cpu -> draw in this process
+    workers = min(workers or os.cpu_count() or 1, len(missing))
+    if workers <= 1:
+        for filename, _ in missing:
+            renderFile(spec, style, filename)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for future in [pool.submit(renderFile, spec, style, filename) for filename, _ in missing]:
+                future.result()
+
+    if cache:
+        os.makedirs(cache, exist_ok=True)
+        for filename, cached in missing:
+            shutil.copyfile(filename, cached + ".tmp")
+            os.replace(cached + ".tmp", cached)
+    return files
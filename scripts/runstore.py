@@ -0,0 +1,181 @@
+## Local sqlite store of the tracked runs, usable without the MLflow server
+##
+## Usage:
+## python runstore.py query --where <KEY=value> --orderBy <metric or parameter> --descending --store <database>
+## python runstore.py sync --store <database> --artifactIndex <index json>
+##
+## Examples:
+## python3 runstore.py query --where "RE_NR=3745" --orderBy "Deposition percentage" --descending
+## python3 runstore.py sync
+##
+## track.py records every run here (parameters, metrics, tags and artifact paths). Runs tracked with
+## --offline are only recorded here, sync replays them to MLflow and uploads their artifacts.
+
+import os
+import time
+import sqlite3
+import argparse
+import pandas as pd
+
+from os.path import join
+from artifacts import defaultIndex
+
+defaultStore = join(os.path.expanduser("~"), ".siminhale", "runs.db")
+
+schema = """
+CREATE TABLE IF NOT EXISTS runs (id TEXT PRIMARY KEY, experiment TEXT, name TEXT, started TEXT,
+                                 directory TEXT, synced INTEGER, mlflowId TEXT);
+CREATE TABLE IF NOT EXISTS params (runId TEXT, key TEXT, value TEXT, num REAL, PRIMARY KEY (runId, key));
+CREATE TABLE IF NOT EXISTS tags (runId TEXT, key TEXT, value TEXT, num REAL, PRIMARY KEY (runId, key));
+CREATE TABLE IF NOT EXISTS metrics (runId TEXT, key TEXT, value REAL, step INTEGER, timestamp INTEGER);
+CREATE TABLE IF NOT EXISTS latestMetrics (runId TEXT, key TEXT, value REAL, step INTEGER, PRIMARY KEY (runId, key));
+CREATE TABLE IF NOT EXISTS artifacts (runId TEXT, path TEXT, artifactPath TEXT);
+CREATE INDEX IF NOT EXISTS paramsByValue ON params (key, num, value);
+CREATE INDEX IF NOT EXISTS tagsByValue ON tags (key, num, value);
+CREATE INDEX IF NOT EXISTS latestByValue ON latestMetrics (key, value);
+CREATE INDEX IF NOT EXISTS metricsByRun ON metrics (runId, key, step);
+CREATE INDEX IF NOT EXISTS artifactsByRun ON artifacts (runId);
+"""
+
+def toNumber(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+class RunStore:
+    def __init__(self, path=defaultStore):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(schema)
+
+    def addRun(self, runId, experiment, name, directory, synced):
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                    (runId, experiment, name, time.strftime("%Y-%m-%d %H:%M:%S"), directory,
+                                     int(synced), runId if synced else None))
+
+    def logParams(self, runId, params):
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO params VALUES (?, ?, ?, ?)",
+                                        [(runId, key, str(value), toNumber(value)) for key, value in params.items()])
+
+    def setTags(self, runId, tags):
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO tags VALUES (?, ?, ?, ?)",
+                                        [(runId, key, str(value), toNumber(value)) for key, value in tags.items()])
+
+    def logMetrics(self, runId, metrics):
+        # metrics: [(key, value, step, timestamp)]
+        with self.connection:
+            self.connection.executemany("INSERT INTO metrics VALUES (?, ?, ?, ?, ?)",
+                                        [(runId, key, float(value), step, timestamp) for key, value, step, timestamp in metrics])
+            self.connection.executemany("""INSERT INTO latestMetrics VALUES (?, ?, ?, ?)
+                                           ON CONFLICT (runId, key) DO UPDATE SET value = excluded.value, step = excluded.step
+                                           WHERE excluded.step >= latestMetrics.step""",
+                                        [(runId, key, float(value), step) for key, value, step, _ in metrics])
+
+    def addArtifacts(self, runId, artifacts):
+        # artifacts: [(local path, artifact path)]
+        with self.connection:
+            self.connection.executemany("INSERT INTO artifacts VALUES (?, ?, ?)",
+                                        [(runId, os.path.abspath(path), artifactPath) for path, artifactPath in artifacts])
+
+    def query(self, where={}, orderBy=None, descending=False, experiment=None):
+        # Runs whose parameters (or tags) equal the given values, sorted by a metric, parameter or tag
+        sql = "SELECT r.id, r.experiment, r.name, r.started, r.directory, r.synced"
+        joins = ""
+        values = []
+        conditions = []
+        for i, (key, value) in enumerate(where.items()):
+            sql += f", p{i}.value AS \"{key}\""
+            column, compared = ("num", toNumber(value)) if toNumber(value) is not None else ("value", str(value))
+            joins += f""" JOIN (SELECT runId, key, value, num FROM params UNION ALL SELECT runId, key, value, num FROM tags) p{i}
+                          ON p{i}.runId = r.id AND p{i}.key = ? AND p{i}.{column} = ?"""
+            values += [key, compared]
+        if orderBy:
+            sql += f", COALESCE(m.value, op.num, op.value) AS \"{orderBy}\""
+            joins += """ LEFT JOIN latestMetrics m ON m.runId = r.id AND m.key = ?
+                         LEFT JOIN (SELECT runId, key, value, num FROM params UNION ALL SELECT runId, key, value, num FROM tags) op
+                         ON op.runId = r.id AND op.key = ?"""
+            values += [orderBy, orderBy]
+        if experiment:
+            conditions.append("r.experiment = ?")
+            values.append(experiment)
+        sql += " FROM runs r" + joins
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        if orderBy:
+            sql += f" ORDER BY \"{orderBy}\" IS NULL, \"{orderBy}\"" + (" DESC" if descending else "")
+        return pd.read_sql_query(sql, self.connection, params=values)
+
+    def findRun(self, experiment, directory):
+        # The latest run of the experiment in the directory, its MLflow id once synced
+        row = self.connection.execute("""SELECT COALESCE(mlflowId, id) FROM runs WHERE experiment = ? AND directory = ?
+                                         ORDER BY started DESC LIMIT 1""", (experiment, os.path.abspath(directory))).fetchone()
+        return row[0] if row else None
+
+    def unsynced(self):
+        return self.connection.execute("SELECT id, experiment, name, directory FROM runs WHERE synced = 0").fetchall()
+
+    def runData(self, runId):
+        params = dict(self.connection.execute("SELECT key, value FROM params WHERE runId = ?", (runId,)).fetchall())
+        tags = dict(self.connection.execute("SELECT key, value FROM tags WHERE runId = ?", (runId,)).fetchall())
+        metrics = self.connection.execute("SELECT key, value, step, timestamp FROM metrics WHERE runId = ? ORDER BY step",
+                                          (runId,)).fetchall()
+        artifacts = self.connection.execute("SELECT path, artifactPath FROM artifacts WHERE runId = ?", (runId,)).fetchall()
+        return params, tags, metrics, artifacts
+
+    def markSynced(self, runId, mlflowId):
+        with self.connection:
+            self.connection.execute("UPDATE runs SET synced = 1, mlflowId = ? WHERE id = ?", (mlflowId, runId))
+
+def sync(store, artifactIndex=None, batchSize=1000):
+    # Replay the offline runs to the MLflow server, returns the number of runs synced
+    import mlflow
+    from mlflow.entities import Metric, Param, RunTag
+    from artifacts import ArtifactUploader
+
+    client = mlflow.tracking.MlflowClient()
+    runs = store.unsynced()
+    for runId, experiment, name, directory in runs:
+        params, tags, metrics, artifacts = store.runData(runId)
+        mlflow.set_experiment(experiment)
+        with mlflow.start_run() as run:
+            mlflowId = run.info.run_id
+            client.log_batch(mlflowId, params=[Param(key, value) for key, value in params.items()],
+                             tags=[RunTag(key, value) for key, value in tags.items()] + [RunTag("mlflow.runName", name)])
+            for start in range(0, len(metrics), batchSize):
+                client.log_batch(mlflowId, metrics=[Metric(key, value, timestamp, step)
+                                                    for key, value, step, timestamp in metrics[start:start + batchSize]])
+            uploader = ArtifactUploader(client, mlflowId, artifactIndex)
+            for path, artifactPath in artifacts:
+                if os.path.exists(path):
+                    uploader.add(path, artifactPath)
+                else:
+                    print("Missing artifact: ", path)
+            uploader.upload()
+        store.markSynced(runId, mlflowId)
+        print(f"Synced run {name} ({runId} -> {mlflowId})")
+    return len(runs)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the local run store or sync it to MLflow")
+    parser.add_argument("command", help="query or sync")
+    parser.add_argument("--store", help="the run store database", default=defaultStore)
+    parser.add_argument("--where", help="KEY=value a run must have, repeat for more", action="append", default=[])
+    parser.add_argument("--orderBy", help="the metric, parameter or tag to sort by", default=None)
+    parser.add_argument("--descending", help="sort in descending order", action="store_true")
+    parser.add_argument("--experiment", help="only runs of this experiment", default=None)
+    parser.add_argument("--artifactIndex", help="sync: the index of the already uploaded artifacts", default=defaultIndex)
+    args = parser.parse_args()
+
+    store = RunStore(args.store)
+    if args.command == "query":
+        where = dict(item.split("=", 1) for item in args.where)
+        with pd.option_context("display.max_rows", None, "display.width", None):
+            print(store.query(where, args.orderBy, args.descending, args.experiment))
+    elif args.command == "sync":
+        print("Runs synced: ", sync(store, args.artifactIndex))
+    else:
+        print("Invalid command")
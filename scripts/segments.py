@@ -0,0 +1,413 @@
+# Airway segment geometry and particle classifiers shared by the scripts
+
+import hashlib
+import inspect
+import numpy as np
+
+def planeCoefficients(point1, point2, point3):
+    # (a, b, c, d) of the plane a*x + b*y + c*z + d = 0 through the 3 points
+    x1, y1, z1 = point1
+    x2, y2, z2 = point2
+    x3, y3, z3 = point3
+    a = (y2 - y1)*(z3 - z1) - (z2 - z1)*(y3 - y1)
+    b = (z2 - z1)*(x3 - x1) - (x2 - x1)*(z3 - z1)
+    c = (x2 - x1)*(y3 - y1) - (y2 - y1)*(x3 - x1)
+    d = -a*x1 - b*y1 - c*z1
+    return a, b, c, d
+
+def sameSideOfPlane(point1, point2, point3, refPoint, point):
+    x, y, z = point
+    rX, rY, rZ = refPoint
+    a, b, c, d = planeCoefficients(point1, point2, point3)
+    val = a*x + b*y + c*z + d
+    refVal = a*rX + b*rY + c*rZ + d
+    return (val > 0 and refVal > 0) or (val < 0 and refVal < 0)
+
+def inSphere(point, seg):
+    x, y, z = point
+    center, radius = seg
+    cX, cY, cZ = center
+    return (x - cX)**2 + (y - cY)**2 + (z - cZ)**2 < radius**2
+
+
+seg3 = ([-0.00916789, 0.107428, -0.191593], 0.010)
+seg4 = ([0.0118495, 0.109477, -0.204223], 0.019)
+seg5 = ([0.0316239, 0.113915, -0.214249], 0.0066)
+seg6a = ([0.0358753, 0.116738, -0.224577], 0.008)
+seg6b = ([0.0333019, 0.126099, -0.224295], 0.0065)
+seg6c = ([0.0408924, 0.119268, -0.231801], 0.007)
+seg7a = ([0.0445801, 0.116936, -0.21015], 0.010)
+seg7b = ([0.0500298, 0.115545, -0.214051], 0.006)
+seg8 = ([-0.0185997, 0.107727, -0.202463], 0.008)
+seg9a = ([-0.0347457, 0.112414, -0.19602], 0.0127)
+seg9b = ([-0.0428033, 0.121789, -0.194985], 0.00625265)
+seg10 = ([-0.0280901, 0.105663, -0.219729], 0.012)
+seg11 = ([-0.0469778, 0.0961967, -0.223908], 0.0136637)
+seg12 = ([-0.0357696, 0.113489, -0.233305], 0.009)
+seg13 = ([0.0614592, 0.133665, -0.179065], 0.031)
+seg14 = ([0.0257088, 0.166302, -0.228401], 0.0388246)
+seg15a = ([0.048863, 0.125997, -0.25725], 0.025)
+seg15b = ([0.0578417, 0.13668, -0.278319], 0.033)
+seg16a = ([0.0678228, 0.12313, -0.218891], 0.0187)
+seg16b = ([0.0889196, 0.132538, -0.227953], 0.028)
+seg17a = ([-0.0670284, 0.0713526, -0.234222], 0.0212804)
+seg17b = ([-0.0871651, 0.0550605, -0.247243], 0.03)
+seg18 = ([-0.0396406, 0.102922, -0.272769], 0.0361585)
+seg19 = ([-0.0723341, 0.101592, -0.173525], 0.0381007)
+seg20 = ([-0.0772369, 0.110594, -0.230988], 0.0245135)
+seg21a = ([-0.0448059, 0.150873, -0.187616], 0.0276968)
+seg21b = ([-0.0537398, 0.164288, -0.188217], 0.0359187)
+seg22a = ([-0.0407379, 0.138604, -0.23724], 0.0200263)
+seg22b = ([-0.0450925, 0.156375, -0.245063], 0.0263275)
+
+# Planes between neighbouring segments:
+# name -> (segment on the reference side, segment on the other side, 3 points on the plane, reference point)
+planeTable = {
+    "seg34": (3, 4, [0.00396, 0.1099, -0.191382], [0.001735, 0.1133, -0.2011], [0.001649, 0.10254, -0.2000], [-0.007, 0.1, -0.193]),
+    "seg45": (4, 5, [0.0257677,0.114642,-0.211365], [0.0264381,0.107334,-0.211896], [0.0242488,0.112508,-0.215532], [0.0164216, 0.108844, -0.207705]),
+    "seg56": (5, 6, [0.0343477, 0.111998, -0.21962], [0.03176, 0.114367, -0.221207], [0.036208, 0.115116, -0.217883], [0.0332826, 0.117274, -0.214308]),
+    "seg57": (5, 7, [0.0387031, 0.111458, -0.211436], [0.0408733, 0.114347, -0.215259], [0.038741, 0.117294, -0.212645], [0.0332826, 0.117274, -0.214308]),
+    "seg614": (6, 14, [0.0326649, 0.125194, -0.224243], [0.0316696, 0.124109, -0.22695], [0.0339185, 0.125326, -0.226154], [0.367313, 0.113588, -0.224294]),
+    "seg615": (6, 15, [0.0403648, 0.115793, -0.231076], [0.0426591, 0.118383, -0.22913], [0.0392978, 0.120591, -0.231464], [0.367313, 0.113588, -0.224294]),
+    "seg713": (7, 13, [0.0451224, 0.119878, -0.203707], [0.0477829, 0.121177, -0.206496], [0.0482063, 0.119171, -0.206787], [0.0434574, 0.112952, -0.210408]),
+    "seg716": (7, 16, [0.0519382, 0.114605, -0.212265], [0.515506, 0.116596, -0.213827], [0.0511742, 0.116374, -0.215987], [0.0434574, 0.112952, -0.210408]),
+    "seg1323": (13, 23, [0.059, 0.121, -0.178], [0.050, 0.126, -0.172], [0.055, 0.149, -0.187], [0.054, 0.119, -0.198]),
+    "seg1424": (14, 24, [0.036, 0.168, -0.221], [0.046, 0.166, -0.235], [0.044, 0.162, -0.247], [0.029, 0.133, -0.235]),
+    "seg1525": (15, 25, [0.062, 0.108, -0.276], [0.041, 0.119, -0.284], [0.067, 0.155, -0.266], [0.045, 0.121, -0.246]),
+    "seg1626": (16, 26, [0.089, 0.108, -0.226], [0.078, 0.118, -0.242], [0.074, 0.141, -0.217], [0.068, 0.111, -0.219]),
+    "seg38": (3, 8, [-0.0155714, 0.101882, -0.1944], [-0.0116865, 0.109269, -0.20228], [-0.0151642, 0.114347, -0.196612], [-0.009, 0.102, -0.192]),
+    "seg89": (8, 9, [-0.0262068, 0.111116, -0.196478], [-0.0283781, 0.108044, -0.20268], [-0.0279246, 0.11303, -0.20205], [-0.014958, 0.103675, -0.202574]),
+    "seg810": (8, 10, [-0.0284162, 0.107697, -0.21279], [-0.0226891, 0.108775, -0.214457], [-0.0236845, 0.106937, -0.216261], [-0.014958, 0.103675, -0.202574]),
+    "seg919": (9, 19, [-0.0451173, 0.113083, -0.191222], [-0.0453529, 0.114524, -0.192305], [-0.0457442, 0.112277, -0.195197], [-0.0335852, 0.110919, -0.195308]),
+    "seg921": (9, 21, [-0.0422019, 0.120862, -0.193467], [-0.0427378, 0.120182, -0.195737], [-0.0401117, 0.121948, -0.195337], [-0.0335852, 0.110919, -0.195308]),
+    "seg1011": (10, 11, [-0.0415394, 0.0974918, -0.227024], [-0.0416943, 0.100341, -0.224749], [-0.0421243, 0.102724, -0.228819], [-0.0323595, 0.103872, -0.227816]),
+    "seg1012": (10, 12, [-0.036299, 0.108656, -0.230138], [-0.0326029, 0.106679, -0.232364], [-0.033017, 0.111906, -0.229614], [-0.0323595, 0.103872, -0.227816]),
+    "seg1117": (11, 17, [-0.0525026, 0.08941, -0.222551], [-0.0518987, 0.0889323, -0.226285], [-0.0535424, 0.0903605, -0.225974], [-0.0497583, 0.0984493, -0.225411]),
+    "seg1120": (11, 20, [-0.0562036, 0.10034, -0.225532], [-0.0561035, 0.0996118, -0.227661], [-0.055674, 0.103075, -0.227932], [-0.0497583, 0.0984493, -0.225411]),
+    "seg1218": (12, 18, [-0.0380397, 0.107117, -0.237818], [-0.0388701, 0.110965, -0.238563], [-0.0342797, 0.108929, -0.23908], [-0.0311773, 0.110894, -0.232258]),
+    "seg1222": (12, 22, [-0.0351501, 0.118375, -0.230849], [-0.0373866, 0.117661, -0.234033], [-0.0329818, 0.117217, -0.234101], [-0.0311773, 0.110894, -0.232258]),
+    "seg1727": (17, 27, [-0.076, 0.055, -0.232], [-0.080, 0.057, -0.229], [-0.070, 0.058, -0.245], [-0.069, 0.073, -0.233]),
+    "seg1828": (18, 28, [-0.047, 0.085, -0.270], [-0.062, 0.094, -0.267], [-0.031, 0.088, -0.272], [-0.038, 0.092, -0.261]),
+    "seg1929": (19, 29, [-0.078, 0.084, -0.195], [-0.066, 0.091, -0.173], [-0.057, 0.100, -0.154], [-0.057, 0.112, -0.171]),
+    "seg2030": (20, 30, [-0.080, 0.109, -0.222], [-0.083, 0.095, -0.235], [-0.080, 0.098, -0.244], [-0.072, 0.097, -0.232]),
+    "seg2131": (21, 31, [-0.056, 0.154, -0.165], [-0.076, 0.146, -0.191], [-0.065, 0.157, -0.219], [-0.073, 0.142, -0.201]),
+    "seg2232": (22, 32, [-0.055, 0.146, -0.225], [-0.061, 0.143, -0.235], [-0.049, 0.139, -0.255], [-0.050, 0.144, -0.234]),
+}
+
+def splitByPlane(name, point):
+    keep, other, point1, point2, point3, refPoint = planeTable[name]
+    return keep if sameSideOfPlane(point1, point2, point3, refPoint, point) else other
+
+class LeftLung:
+    def __init__(self, point):
+        self.point = point
+
+    def seg34(self):
+        return splitByPlane("seg34", self.point)
+
+    def seg45(self):
+        return splitByPlane("seg45", self.point)
+
+    def seg56(self):
+        return splitByPlane("seg56", self.point)
+
+    def seg57(self):
+        return splitByPlane("seg57", self.point)
+
+    def seg614(self):
+        return splitByPlane("seg614", self.point)
+
+    def seg615(self):
+        return splitByPlane("seg615", self.point)
+
+    def seg713(self):
+        return splitByPlane("seg713", self.point)
+
+    def seg716(self):
+        return splitByPlane("seg716", self.point)
+
+    def seg1323(self):
+        return splitByPlane("seg1323", self.point)
+
+    def seg1424(self):
+        return splitByPlane("seg1424", self.point)
+
+    def seg1525(self):
+        return splitByPlane("seg1525", self.point)
+
+    def seg1626(self):
+        return splitByPlane("seg1626", self.point)
+
+class RightLung:
+    def __init__(self, point):
+        self.point = point
+
+    def seg38(self):
+        return splitByPlane("seg38", self.point)
+
+    def seg89(self):
+        return splitByPlane("seg89", self.point)
+
+    def seg810(self):
+        return splitByPlane("seg810", self.point)
+
+    def seg919(self):
+        return splitByPlane("seg919", self.point)
+
+    def seg921(self):
+        return splitByPlane("seg921", self.point)
+
+    def seg1011(self):
+        return splitByPlane("seg1011", self.point)
+
+    def seg1012(self):
+        return splitByPlane("seg1012", self.point)
+
+    def seg1117(self):
+        return splitByPlane("seg1117", self.point)
+
+    def seg1120(self):
+        return splitByPlane("seg1120", self.point)
+
+    def seg1218(self):
+        return splitByPlane("seg1218", self.point)
+
+    def seg1222(self):
+        return splitByPlane("seg1222", self.point)
+
+    def seg1727(self):
+        return splitByPlane("seg1727", self.point)
+
+    def seg1828(self):
+        return splitByPlane("seg1828", self.point)
+
+    def seg1929(self):
+        return splitByPlane("seg1929", self.point)
+
+    def seg2030(self):
+        return splitByPlane("seg2030", self.point)
+
+    def seg2131(self):
+        return splitByPlane("seg2131", self.point)
+
+    def seg2232(self):
+        return splitByPlane("seg2232", self.point)
+
+
+def categorise(row, moreSeg=False):
+    if row['z'] >= -0.06:
+        return 1
+    if row['z'] >= -0.187 and row['x'] >= -0.0165 and row['x'] < 0.020:
+        return 2
+
+    point = [row['x'], row['y'], row['z']]
+    ll = LeftLung(point)
+    rl = RightLung(point)
+
+    # Left Lung
+    if inSphere(point, seg3):
+        return 3
+    if inSphere(point, seg4):
+        return 4
+    if inSphere(point, seg5):
+        return 5
+
+    if inSphere(point, seg6a) or inSphere(point, seg6b) or inSphere(point, seg6c):
+        return 6
+    if inSphere(point, seg14):
+        return ll.seg1424() if moreSeg else 14
+    if inSphere(point, seg15a) or inSphere(point, seg15b):
+        return ll.seg1525() if moreSeg else 15
+
+    if inSphere(point, seg7a) or inSphere(point, seg7b):
+        return 7
+    if inSphere(point, seg13):
+        return ll.seg1323() if moreSeg else 13
+    if inSphere(point, seg16a) or inSphere(point, seg16b):
+        return ll.seg1626() if moreSeg else 16
+
+    # Right Lung
+    if inSphere(point, seg8):
+        return 8
+    if inSphere(point, seg9a) or inSphere(point, seg9b):
+        return 9
+    if inSphere(point, seg19):
+        return rl.seg1929() if moreSeg else 19
+    if inSphere(point, seg21a) or inSphere(point, seg21b):
+        return rl.seg2131() if moreSeg else 21
+
+    if inSphere(point, seg10):
+        return 10
+    if inSphere(point, seg11):
+        return 11
+    if inSphere(point, seg17a) or inSphere(point, seg17b):
+        return rl.seg1727() if moreSeg else 17
+    if inSphere(point, seg20):
+        return rl.seg2030() if moreSeg else 20
+
+    if inSphere(point, seg12):
+        return 12
+    if inSphere(point, seg18):
+        return rl.seg1828() if moreSeg else 18
+    if inSphere(point, seg22a) or inSphere(point, seg22b):
+        return rl.seg2232() if moreSeg else 22
+
+    return -1
+
+
+# Sphere tests in the order categorise() applies them, the first match wins
+sphereTable = [
+    (3, [seg3]),
+    (4, [seg4]),
+    (5, [seg5]),
+    (6, [seg6a, seg6b, seg6c]),
+    (14, [seg14]),
+    (15, [seg15a, seg15b]),
+    (7, [seg7a, seg7b]),
+    (13, [seg13]),
+    (16, [seg16a, seg16b]),
+    (8, [seg8]),
+    (9, [seg9a, seg9b]),
+    (19, [seg19]),
+    (21, [seg21a, seg21b]),
+    (10, [seg10]),
+    (11, [seg11]),
+    (17, [seg17a, seg17b]),
+    (20, [seg20]),
+    (12, [seg12]),
+    (18, [seg18]),
+    (22, [seg22a, seg22b]),
+]
+
+# Flattened copy of sphereTable, one row per sphere, still in priority order
+sphereLabels = np.array([segment for segment, spheres in sphereTable for _ in spheres])
+sphereCenters = np.array([center for _, spheres in sphereTable for center, _ in spheres])
+sphereRadii = np.array([radius for _, spheres in sphereTable for _, radius in spheres])
+
+# Plane coefficients computed once, one (a, b, c, d) row per planeTable entry
+planeNames = list(planeTable)
+planeMatrix = np.array([planeCoefficients(*plane[2:5]) for plane in planeTable.values()])
+planeKeep = np.array([plane[0] for plane in planeTable.values()])
+planeOther = np.array([plane[1] for plane in planeTable.values()])
+planeRefPoints = np.array([plane[5] for plane in planeTable.values()])
+planeRefValues = (planeMatrix[:, 0]*planeRefPoints[:, 0] + planeMatrix[:, 1]*planeRefPoints[:, 1]
+                  + planeMatrix[:, 2]*planeRefPoints[:, 2] + planeMatrix[:, 3])
+
+# Planes splitting the generation 13-22 segments into 23-32
+subdivisionPlanes = {
+    13: "seg1323", 14: "seg1424", 15: "seg1525", 16: "seg1626",
+    17: "seg1727", 18: "seg1828", 19: "seg1929", 20: "seg2030",
+    21: "seg2131", 22: "seg2232",
+}
+subdivisionRows = np.array([planeNames.index(name) for name in subdivisionPlanes.values()])
+# segment -> column of its plane in subdivisionRows, -1 if it is not split
+subdivisionColumns = np.full(33, -1)
+subdivisionColumns[list(subdivisionPlanes)] = np.arange(len(subdivisionPlanes))
+
+def slabSections(x, z):
+    # z/x slab rules for segments 1 and 2, 0 where neither applies
+    return np.where(z >= -0.06, 1,
+                    np.where((z >= -0.187) & (x >= -0.0165) & (x < 0.020), 2, 0))
+
+def sphereSections(x, y, z):
+    # First matching sphere of each point, -1 if it is in none of them
+    inside = ((x[:, None] - sphereCenters[:, 0])**2
+              + (y[:, None] - sphereCenters[:, 1])**2
+              + (z[:, None] - sphereCenters[:, 2])**2) < sphereRadii**2
+    return np.where(inside.any(axis=1), sphereLabels[inside.argmax(axis=1)], -1)
+
+def halfSpaces(x, y, z, rows=slice(None)):
+    # True where a point is on the reference side of a plane, one column per plane row
+    values = np.column_stack([x, y, z, np.ones_like(x)]) @ planeMatrix[rows].T
+    refValues = planeRefValues[rows]
+    return ((values > 0) & (refValues > 0)) | ((values < 0) & (refValues < 0))
+
+def subdivide(section, x, y, z):
+    # Split the generation 13-22 sections into 23-32 like categorise(row, moreSeg=True)
+    column = subdivisionColumns[np.maximum(section, 0)]
+    idx = np.flatnonzero(column >= 0)
+    if len(idx) == 0:
+        return section
+    column = column[idx]
+    sameSide = halfSpaces(x[idx], y[idx], z[idx], subdivisionRows)[np.arange(len(idx)), column]
+    rows = subdivisionRows[column]
+    section = section.copy()
+    section[idx] = np.where(sameSide, planeKeep[rows], planeOther[rows])
+    return section
+
+def classify(x, y, z, moreSeg=False, blockSize=65536, sphereTest=sphereSections):
+    # Vectorized categorise() over coordinate arrays, returns the section of every point
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    z = np.asarray(z, dtype=np.float64)
+
+    section = slabSections(x, z).astype(np.int64)
+    pending = np.flatnonzero(section == 0)
+    # the (points x spheres) test matrix is built per block to bound memory
+    for start in range(0, len(pending), blockSize):
+        idx = pending[start:start + blockSize]
+        blockSection = sphereTest(x[idx], y[idx], z[idx])
+        if moreSeg:
+            blockSection = subdivide(blockSection, x[idx], y[idx], z[idx])
+        section[idx] = blockSection
+    return section
+
+def geometryVersion():
+    # Changes whenever the segment tables or the classification rules are edited
+    source = [repr(sphereTable), repr(planeTable), repr(subdivisionPlanes), repr(boxTable)]
+    source += [inspect.getsource(f) for f in (categorise, slabSections, sphereSections, subdivide, classify, classifyBoxes)]
+    return hashlib.sha1("\n".join(source).encode()).hexdigest()
+
+def classifyFrame(df, classifier=classify, **kwargs):
+    return classifier(df['x'].to_numpy(), df['y'].to_numpy(), df['z'].to_numpy(), **kwargs)
+
+
+# Bounding box rules used by track.py: (segment, (zMin, zMax), (xMin, xMax), (yMin, yMax)),
+# a None range is not tested, the first match wins
+boxTable = [
+    (1,  (-0.06, None),    None,               None),
+    (2,  (-0.180, None),   (-0.016, 0.002),    None),
+    (3,  (-0.200, None),   (-0.018, 0.002),    None),
+    (4,  (-0.216, None),   (-0.006, 0.030),    None),
+    (5,  (-0.220, None),   (0.025, 0.037),     None),
+    (6,  (-0.228, -0.215), (0.031, 0.042),     None),
+    (7,  (-0.217, -0.207), (0.033, 0.047),     None),
+    (8,  (-0.207, -0.187), (-0.026, -0.007),   None),
+    (9,  (-0.206, -0.190), (-0.037, -0.023),   None),
+    (10, (-0.225, -0.205), (-0.034, -0.014),   None),
+    (11, (-0.230, -0.221), (-0.049, -0.031),   None),
+    (12, (-0.246, -0.226), (-0.042, -0.032),   None),
+    (13, (-0.210, -0.150), (0.041, 0.090),     None),
+    (14, (-0.260, -0.220), (0.011, 0.046),     None),
+    (15, (-0.310, -0.230), (0.033, 0.083),     None),
+    (16, (-0.245, -0.205), (0.047, 0.111),     None),
+    (17, (-0.260, -0.222), (-0.110, -0.047),   None),
+    (18, (-0.310, -0.230), (-0.066, -0.020),   (0.080, 0.120)),
+    (19, (-0.200, -0.140), (-0.110, -0.040),   (0.080, 0.134)),
+    (20, (-0.245, -0.225), (-0.100, -0.044),   (0.095, 0.110)),
+    (21, (-0.230, -0.150), (-0.090, -0.020),   (0.110, 0.210)),
+    (22, (-0.290, -0.220), (-0.070, -0.025),   (0.120, 0.180)),
+]
+
+def inRange(values, bounds):
+    low, high = bounds
+    mask = values >= low
+    return mask if high is None else mask & (values < high)
+
+def classifyBoxes(x, y, z):
+    # Vectorized form of the bounding box rules in boxTable
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    z = np.asarray(z, dtype=np.float64)
+
+    section = np.full(x.shape, -1, dtype=np.int64)
+    pending = np.ones(x.shape, dtype=bool)
+    for segment, zRange, xRange, yRange in boxTable:
+        mask = pending & inRange(z, zRange)
+        if xRange is not None:
+            mask &= inRange(x, xRange)
+        if yRange is not None:
+            mask &= inRange(y, yRange)
+        section[mask] = segment
+        pending &= ~mask
+    return section
@@ -0,0 +1,94 @@
+# Helpers for the siminhale_<index>.csv particle snapshots written by the solver
+
+import os
+import json
+import time
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+
+def snapshotIndex(filename):
+    return int(os.path.basename(filename).split("_")[1].split(".")[0])
+
+def snapshotFiles(path):
+    # siminhale_<index>.csv files of a folder in index order
+    files = [f for f in os.listdir(path) if f.startswith("siminhale_") and f.endswith(".csv")]
+    files = [f for f in files if f.split("_")[1].split(".")[0].isdigit()]
+    return sorted(files, key=snapshotIndex)
+
+def completeSnapshots(path, files, settle):
+    # A snapshot is complete once a later one exists, the newest once it is unchanged for settle seconds
+    if len(files) == 0:
+        return files
+    if time.time() - os.stat(os.path.join(path, files[-1])).st_mtime >= settle:
+        return files
+    return files[:-1]
+
+# Compact dtypes of the snapshot columns, others are kept as pandas reads them. The coordinates stay
+# float64: they are classified, and float32 moves points on a segment boundary to another section.
+columnTypes = {"u": np.float32, "deposition": np.int8, "escaped": np.int8, "error": np.int8}
+
+def sidecarPath(filename):
+    return filename + ".cols"
+
+def sidecarMeta(filename):
+    # the sidecar's meta data, None if the sidecar is missing or older than the csv
+    try:
+        with open(os.path.join(sidecarPath(filename), "meta.json"), "r") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    stat = os.stat(filename)
+    if (meta["size"], meta["mtime"]) != (stat.st_size, stat.st_mtime_ns):
+        return None
+    return meta
+
+def readSidecar(filename, columns, meta=None):
+    # the memory-mapped columns, None if the sidecar is outdated or misses one of them
+    meta = meta or sidecarMeta(filename)
+    if meta is None:
+        return None
+    columns = columns or meta["columns"]
+    if any(column not in meta["columns"] for column in columns):
+        return None
+    path = sidecarPath(filename)
+    # copy=False keeps every column a view of its memory map instead of one block loaded into memory
+    return pd.DataFrame({column: np.load(os.path.join(path, column + ".npy"), mmap_mode="r") for column in columns},
+                        copy=False)
+
+def writeSidecar(filename, df, keep=()):
+    # the columns of df and the kept columns of the current sidecar as <column>.npy, written to a
+    # temporary folder that then replaces the old sidecar
+    path = sidecarPath(filename)
+    stat = os.stat(filename)
+    tmpPath = tempfile.mkdtemp(prefix=os.path.basename(path) + ".", dir=os.path.dirname(os.path.abspath(filename)))
+    kept = [column for column in keep if column not in df.columns]
+    for column in kept:
+        try:
+            os.link(os.path.join(path, column + ".npy"), os.path.join(tmpPath, column + ".npy"))
+        except OSError:
+            shutil.copyfile(os.path.join(path, column + ".npy"), os.path.join(tmpPath, column + ".npy"))
+    for column in df.columns:
+        np.save(os.path.join(tmpPath, column + ".npy"), df[column].to_numpy())
+    with open(os.path.join(tmpPath, "meta.json"), "w") as f:
+        json.dump({"size": stat.st_size, "mtime": stat.st_mtime_ns, "rows": len(df), "columns": kept + list(df.columns)}, f)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmpPath, path)
+
+def loadSnapshot(filename, columns=None, sidecar=True):
+    # A snapshot with compact dtypes, only the given columns (default all). With sidecar the columns are
+    # stored next to the csv and memory-mapped by later reads until the csv changes (size or mtime); only
+    # the requested columns are parsed and added to it. Callers that read a snapshot once pass sidecar=False.
+    meta = sidecarMeta(filename) if sidecar else None
+    df = readSidecar(filename, columns, meta) if meta else None
+    if df is not None:
+        return df
+    df = pd.read_csv(filename, usecols=columns)
+    df = df.astype({column: dtype for column, dtype in columnTypes.items() if column in df.columns})
+    if sidecar:
+        try:
+            writeSidecar(filename, df, meta["columns"] if meta else ())
+        except OSError as e:
+            print(f"Could not write the sidecar of {filename}: {e}")
+    return df[columns] if columns else df
@@ -0,0 +1,82 @@
+# Velocity statistics of the Solution_*.bin fluid solutions without loading them into memory
+# Usage: python solutions.py <folder containing the solutions> --kind <u> --components <3> --workers <processes> --csv <file>
+# A solution file is a raw array of doubles with the velocity components one after the other
+# (u1 of every dof, then u2, then u3). Files are memory-mapped and read in blocks of dofs; for every
+# timestep the velocity magnitude min/max/mean and the change from the previous timestep are computed.
+
+import os
+import re
+import argparse
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+def solutionStep(filename):
+    # Solution_u_12.bin -> 12, files without a number come first
+    numbers = re.findall(r"\d+", filename)
+    return int(numbers[-1]) if numbers else -1
+
+def solutionFiles(path, kind="u"):
+    files = [f for f in os.listdir(path) if f.startswith("Solution_") and f.endswith(".bin")
+             and f.split("_")[1].split(".")[0].lower() == kind.lower()]
+    return sorted(files, key=solutionStep)
+
+def components(filename, count=3, dtype=np.float64, headerBytes=0):
+    # the velocity components of a file as memory-mapped views, shape (count, dofs)
+    data = np.memmap(filename, dtype=dtype, mode="r", offset=headerBytes)
+    if len(data) % count != 0:
+        raise ValueError(f"{filename} has {len(data)} values, not a multiple of {count} components")
+    return data.reshape(count, -1)
+
+def velocityStats(filename, previous=None, count=3, blockSize=1 << 20, dtype=np.float64, headerBytes=0):
+    # Magnitude min/max/mean, and the L2 and max change from the previous file if given
+    u = components(filename, count, dtype, headerBytes)
+    v = components(previous, count, dtype, headerBytes) if previous else None
+    if v is not None and v.shape != u.shape:
+        raise ValueError(f"{filename} and {previous} have a different number of dofs")
+    dofs = u.shape[1]
+    minimum, maximum, total = np.inf, -np.inf, 0.0
+    squaredNorm, squaredChange, maxChange = 0.0, 0.0, 0.0
+    for start in range(0, dofs, blockSize):
+        block = np.asarray(u[:, start:start + blockSize], dtype=np.float64)
+        magnitude = np.sqrt(np.einsum("ij,ij->j", block, block))
+        minimum = min(minimum, magnitude.min())
+        maximum = max(maximum, magnitude.max())
+        total += magnitude.sum()
+        if v is not None:
+            difference = block - v[:, start:start + blockSize]
+            squaredNorm += np.einsum("ij,ij->", block, block)
+            squaredChange += np.einsum("ij,ij->", difference, difference)
+            maxChange = max(maxChange, np.abs(difference).max())
+    stats = {"step": solutionStep(os.path.basename(filename)), "velocityMin": minimum, "velocityMax": maximum,
+             "velocityMean": total / dofs if dofs else np.nan}
+    if v is not None:
+        # relative L2 change, 0 once the flow is converged
+        stats["velocityChange"] = np.sqrt(squaredChange / squaredNorm) if squaredNorm > 0 else np.sqrt(squaredChange)
+        stats["velocityMaxChange"] = maxChange
+    return stats
+
+def directoryStats(path, kind="u", count=3, workers=4, blockSize=1 << 20, dtype=np.float64, headerBytes=0):
+    # One row per timestep, the files are processed in parallel (each with its predecessor)
+    files = [os.path.join(path, f) for f in solutionFiles(path, kind)]
+    previous = [None] + files[:-1]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        rows = list(pool.map(velocityStats, files, previous, [count] * len(files), [blockSize] * len(files),
+                             [dtype] * len(files), [headerBytes] * len(files)))
+    return pd.DataFrame(rows)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Velocity statistics of the fluid solution files")
+    parser.add_argument("path", nargs="?", help="the folder containing the Solution_*.bin files", default=".")
+    parser.add_argument("--kind", help="the solution type of the velocity files, Solution_<kind>_<step>.bin", default="u")
+    parser.add_argument("--components", help="the number of velocity components", type=int, default=3)
+    parser.add_argument("--workers", help="the number of processes", type=int, default=4)
+    parser.add_argument("--headerBytes", help="bytes to skip at the start of every file", type=int, default=0)
+    parser.add_argument("--csv", help="write the statistics to this csv", default=None)
+    args = parser.parse_args()
+
+    stats = directoryStats(args.path, args.kind, args.components, args.workers, headerBytes=args.headerBytes)
+    with pd.option_context("display.max_rows", None, "display.width", None):
+        print(stats)
+    if args.csv:
+        stats.to_csv(args.csv, index=False)
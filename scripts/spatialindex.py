@@ -0,0 +1,70 @@
+# Uniform grid index over the segment spheres, each particle only tests the spheres whose
+# bounding box overlaps its cell. Candidates stay in sphereTable order, so the first match
+# (and therefore the section) is the same as in segments.classify
+
+import numpy as np
+
+from segments import classify, sphereCenters, sphereRadii, sphereLabels
+
+class SphereIndex:
+    def __init__(self, cellSize=0.01):
+        self.cellSize = cellSize
+        low = (sphereCenters - sphereRadii[:, None]).min(axis=0)
+        high = (sphereCenters + sphereRadii[:, None]).max(axis=0)
+        self.origin = low
+        self.shape = tuple(max(int(n), 1) for n in np.ceil((high - low) / cellSize))
+
+        # cells overlapped by the (slightly widened) bounding box of every sphere
+        margin = cellSize * 1e-6
+        first = np.floor((sphereCenters - sphereRadii[:, None] - margin - low) / cellSize).astype(int)
+        last = np.floor((sphereCenters + sphereRadii[:, None] + margin - low) / cellSize).astype(int)
+        first = np.clip(first, 0, np.array(self.shape) - 1)
+        last = np.clip(last, 0, np.array(self.shape) - 1)
+        member = np.zeros(self.shape + (len(sphereLabels),), dtype=bool)
+        for s in range(len(sphereLabels)):
+            (i0, j0, k0), (i1, j1, k1) = first[s], last[s]
+            member[i0:i1 + 1, j0:j1 + 1, k0:k1 + 1, s] = True
+
+        # cells with the same candidate spheres share one entry
+        sets, self.cellSet = np.unique(member.reshape(-1, len(sphereLabels)), axis=0, return_inverse=True)
+        self.cellSet = self.cellSet.reshape(-1)
+        self.candidates = [np.flatnonzero(row) for row in sets]
+
+        self.tested = 0
+        self.scanned = 0
+
+    def sphereSections(self, x, y, z):
+        # Same result as segments.sphereSections, testing only the candidate spheres of each cell
+        with np.errstate(invalid="ignore"):
+            ijk = np.floor((np.column_stack([x, y, z]) - self.origin) / self.cellSize)
+        inGrid = np.all((ijk >= 0) & (ijk < self.shape), axis=1)
+        setId = np.full(len(x), -1)
+        setId[inGrid] = self.cellSet[np.ravel_multi_index(ijk[inGrid].astype(np.int64).T, self.shape)]
+
+        section = np.full(len(x), -1, dtype=np.int64)
+        order = np.argsort(setId, kind="stable")
+        ids, starts = np.unique(setId[order], return_index=True)
+        stops = np.append(starts[1:], len(x))
+        for setIndex, start, stop in zip(ids, starts, stops):
+            candidates = self.candidates[setIndex] if setIndex >= 0 else []
+            if len(candidates) == 0:
+                continue
+            idx = order[start:stop]
+            inside = ((x[idx, None] - sphereCenters[candidates, 0])**2
+                      + (y[idx, None] - sphereCenters[candidates, 1])**2
+                      + (z[idx, None] - sphereCenters[candidates, 2])**2) < sphereRadii[candidates]**2
+            section[idx] = np.where(inside.any(axis=1), sphereLabels[candidates][inside.argmax(axis=1)], -1)
+            self.tested += len(idx) * len(candidates)
+        self.scanned += len(x) * len(sphereLabels)
+        return section
+
+    def classify(self, x, y, z, moreSeg=False):
+        # The 23-32 planes are only evaluated for particles already inside their segment
+        return classify(x, y, z, moreSeg=moreSeg, sphereTest=self.sphereSections)
+
+    def prunedFraction(self):
+        return 1 - self.tested / self.scanned if self.scanned else 0.0
+
+    def report(self):
+        print("Sphere tests: ", self.tested, " of ", self.scanned)
+        print("Pruned sphere tests percentage: ", self.prunedFraction() * 100)
@@ -1,37 +1,142 @@
 # Generates 2 groups of csv files for deposited particles and not deposited particles
-# Usage: python split_particles.py <folder containing particles csv>
+# Usage: python split_particles.py <folder containing particles csv> --workers <number of processes> --multiway --moreSegments
+# --multiway -> split by status (deposited, escaped, stagnant, errored) and by segment instead
 
 import os
 import sys
+import argparse
+import numpy as np
 import pandas as pd
 from tqdm import tqdm
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from segments import classifyFrame
 
-path = sys.argv[1] or "."
-deposited_path = os.path.join(path, "deposited")
-not_deposited_path = os.path.join(path, "not_deposited")
+statusNames = ["deposited", "escaped", "stagnant", "errored"]
 
-all_files = os.listdir(path) 
-
-siminhale_files = [file for file in all_files if file.startswith("siminhale_") and file.endswith(".csv")]
-
-N = len(siminhale_files)
-print("Number of files: ", N)
-print("Deposited path: ", deposited_path)
-print("Not deposited path: ", not_deposited_path)
-
-if not os.path.exists(deposited_path):
-    os.makedirs(deposited_path)
-    os.makedirs(not_deposited_path)
-
-for i in tqdm(range(len(siminhale_files))):
-    filename = siminhale_files[i]
+def splitFile(filename, path, deposited_path, not_deposited_path):
     index = filename.split("_")[1].split(".")[0]
     df = pd.read_csv(os.path.join(path, filename))
     df_deposited = df[df["deposition"] == 1]
     df_not_deposited = df[df["deposition"] != 1]
 
     if df_deposited.empty:
-       df_deposited[0, :] = [0 for _ in range(len(df.columns))] 
+       df_deposited[0, :] = [0 for _ in range(len(df.columns))]
 
     df_deposited.to_csv(os.path.join(deposited_path, f"siminhale_deposited_{index}.csv"), index=False)
     df_not_deposited.to_csv(os.path.join(not_deposited_path, f"siminhale_not_deposited_{index}.csv"), index=False)
+
+def statusKeys(df):
+    # One status per particle: errored first, then escaped, then deposited, else stagnant
+    return np.select([df["error"] == 1, df["escaped"] == 1, df["deposition"] == 1],
+                     [statusNames.index("errored"), statusNames.index("escaped"), statusNames.index("deposited")],
+                     default=statusNames.index("stagnant"))
+
+def partition(df, keys, values):
+    # Rows of df for every key value from one stable sort, in their original order
+    order = np.argsort(keys, kind="stable")
+    sortedKeys = keys[order]
+    starts = np.searchsorted(sortedKeys, values, side="left")
+    stops = np.searchsorted(sortedKeys, values, side="right")
+    return [df.iloc[order[start:stop]] for start, stop in zip(starts, stops)]
+
+def multiwaySections(moreSeg=False):
+    return np.array([-1] + list(range(1, 33 if moreSeg else 23)))
+
+def segmentName(section):
+    return "unclassified" if section == -1 else f"segment_{section}"
+
+def multiwayFolders(path, moreSeg=False):
+    return [os.path.join(path, name) for name in statusNames + [segmentName(i) for i in multiwaySections(moreSeg)]]
+
+def splitFileMultiway(filename, path, moreSeg=False, writers=4):
+    index = filename.split("_")[1].split(".")[0]
+    df = pd.read_csv(os.path.join(path, filename))
+
+    sections = multiwaySections(moreSeg)
+    outputs = zip(statusNames, partition(df, statusKeys(df), np.arange(len(statusNames))))
+    outputs = list(outputs) + list(zip([segmentName(i) for i in sections],
+                                       partition(df, classifyFrame(df, moreSeg=moreSeg), sections)))
+
+    # every key gets a file, even an empty one, so each folder is a complete time series
+    with ThreadPoolExecutor(max_workers=writers) as pool:
+        futures = [pool.submit(frame.to_csv, os.path.join(path, name, f"siminhale_{name}_{index}.csv"), index=False)
+                   for name, frame in outputs]
+        for future in futures:
+            future.result()
+
+def splitSerial(files, split):
+    errors = {}
+    for i in tqdm(range(len(files))):
+        try:
+            split(files[i])
+        except Exception as e:
+            errors[files[i]] = e
+    return errors
+
+def splitParallel(files, split, workers=2):
+    # at most 2 files per worker are in flight, so memory does not grow with the number of files
+    errors = {}
+    pending = {}
+    remaining = iter(files)
+    with ProcessPoolExecutor(max_workers=workers) as pool, tqdm(total=len(files)) as progress:
+        while True:
+            while len(pending) < 2 * workers:
+                filename = next(remaining, None)
+                if filename is None:
+                    break
+                pending[pool.submit(split, filename)] = filename
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                filename = pending.pop(future)
+                if future.exception() is not None:
+                    errors[filename] = future.exception()
+                progress.update(1)
+    return errors
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Split the particle csv files into deposited and not deposited particles")
+    parser.add_argument("path", nargs="?", help="the folder containing the particle csv files", default=".")
+    parser.add_argument("--workers", help="the number of processes, 1 -> serial", type=int, default=1)
+    parser.add_argument("--multiway", help="split by status and by segment in one read of each file", action="store_true")
+    parser.add_argument("--moreSegments", help="split the generation 13-22 segments into 23-32", action="store_true")
+    parser.add_argument("--writers", help="the number of writer threads per file in the multiway mode", type=int, default=4)
+    args = parser.parse_args()
+
+    path = args.path
+    deposited_path = os.path.join(path, "deposited")
+    not_deposited_path = os.path.join(path, "not_deposited")
+
+    all_files = os.listdir(path)
+
+    siminhale_files = [file for file in all_files if file.startswith("siminhale_") and file.endswith(".csv")]
+
+    N = len(siminhale_files)
+    print("Number of files: ", N)
+
+    if args.multiway:
+        for folder in multiwayFolders(path, args.moreSegments):
+            os.makedirs(folder, exist_ok=True)
+        print("Output paths: ", ", ".join(statusNames), "and one folder per segment")
+        split = partial(splitFileMultiway, path=path, moreSeg=args.moreSegments, writers=args.writers)
+    else:
+        print("Deposited path: ", deposited_path)
+        print("Not deposited path: ", not_deposited_path)
+
+        if not os.path.exists(deposited_path):
+            os.makedirs(deposited_path)
+            os.makedirs(not_deposited_path)
+        split = partial(splitFile, path=path, deposited_path=deposited_path, not_deposited_path=not_deposited_path)
+
+    if args.workers > 1:
+        errors = splitParallel(siminhale_files, split, args.workers)
+    else:
+        errors = splitSerial(siminhale_files, split)
+
+    for filename, error in errors.items():
+        print(f"Failed to split {filename}: {type(error).__name__}: {error}")
+    if errors:
+        print("Failed files: ", len(errors))
+        sys.exit(1)
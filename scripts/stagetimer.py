@@ -0,0 +1,127 @@
+# Wall time, cpu time, bytes read/written and peak memory of the stages of a tracked run
+# The peak memory is per stage on linux (the high-water mark is reset through /proc/self/clear_refs),
+# elsewhere the lifetime peak of the process and its children is reported as lifetimePeakRss.
+# Stages can be nested, a nested stage is named <outer>/<inner>. With profile=True every outermost
+# stage runs under cProfile and the profile of the slowest one is kept.
+
+import os
+import sys
+import time
+import cProfile
+import resource
+from contextlib import contextmanager
+
+def ioBytes():
+    # bytes read and written by this process so far (including sockets), None where /proc is missing
+    try:
+        with open("/proc/self/io", "r") as f:
+            values = dict(line.split(":") for line in f if ":" in line)
+        return int(values["rchar"]), int(values["wchar"])
+    except (OSError, KeyError, ValueError):
+        return None
+
+def cpuSeconds():
+    # this process and its finished children (the solver)
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+def peakRss():
+    # bytes, the high-water mark since the last resetPeakRss (VmHWM), None where /proc is missing
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+def resetPeakRss():
+    # True if the high-water mark was reset to the current rss
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+def lifetimePeakRss():
+    # bytes, ru_maxrss is in KB on linux and in bytes on macOS
+    rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return rss if sys.platform == "darwin" else rss * 1024
+
+class StageTimer:
+    def __init__(self, profile=False):
+        self.profile = profile
+        # name -> {"wall", "cpu", "read", "written", "peakRss" or "lifetimePeakRss"}, in the order the stages started
+        self.stages = {}
+        self.running = []
+        self.profiles = {}
+        # the peak rss of every running stage so far; the high-water mark is reset at the start of every
+        # stage, so the enclosing stages keep the peak seen before the reset
+        self.peaks = {}
+
+    def foldPeak(self):
+        peak = peakRss()
+        for name in self.peaks:
+            self.peaks[name] = max(self.peaks[name], peak or 0)
+
+    @contextmanager
+    def stage(self, name):
+        name = "/".join(self.running + [name])
+        self.running.append(name.split("/")[-1])
+        self.stages[name] = {}
+        self.foldPeak()
+        perStage = resetPeakRss() and peakRss() is not None
+        if perStage:
+            self.peaks[name] = 0
+        profiler = cProfile.Profile() if self.profile and len(self.running) == 1 else None
+        startIo = ioBytes()
+        startCpu = cpuSeconds()
+        start = time.perf_counter()
+        if profiler:
+            profiler.enable()
+        try:
+            yield
+        finally:
+            if profiler:
+                profiler.disable()
+                self.profiles[name] = profiler
+            stats = {"wall": time.perf_counter() - start, "cpu": cpuSeconds() - startCpu}
+            if perStage:
+                self.foldPeak()
+                stats["peakRss"] = self.peaks.pop(name)
+            else:
+                # this process and the solver since they started, not only this stage
+                stats["lifetimePeakRss"] = lifetimePeakRss()
+            endIo = ioBytes()
+            if startIo and endIo:
+                stats["read"] = endIo[0] - startIo[0]
+                stats["written"] = endIo[1] - startIo[1]
+            self.stages[name] = stats
+            self.running.pop()
+
+    def metrics(self):
+        # [(key, value)] like stage.logArtifacts.wall
+        return [(f"stage.{name.replace('/', '.')}.{key}", value) for name, stats in self.stages.items() for key, value in stats.items()]
+
+    def slowest(self):
+        # the outermost stage with the longest wall time
+        outer = {name: stats for name, stats in self.stages.items() if "/" not in name and "wall" in stats}
+        return max(outer, key=lambda name: outer[name]["wall"]) if outer else None
+
+    def dumpProfile(self, directory):
+        # write the profile of the slowest stage, returns its path
+        name = self.slowest()
+        if name not in self.profiles:
+            return None
+        path = os.path.join(directory, f"profile_{name}.prof")
+        self.profiles[name].dump_stats(path)
+        return path
+
+    def report(self):
+        for name, stats in self.stages.items():
+            line = f"{name:<40} wall {stats.get('wall', 0):9.3f} s  cpu {stats.get('cpu', 0):9.3f} s  peak {stats.get('peakRss', stats.get('lifetimePeakRss', 0)) / 2**20:8.1f} MB"
+            if "read" in stats:
+                line += f"  read {stats['read']} B  written {stats['written']} B"
+            print(line)
@@ -0,0 +1,136 @@
+## Runs a parameter sweep of a simulation concurrently and tracks every finished run with track.py
+##
+## Usage:
+## python sweep.py <experiment> <sweepDirectory> <baseDatFile> --grid <KEY=v1,v2,...> --executable <executable> --args <comma separated extra arguments> --cpus <cpus> --memory <GB> --jobMemory <GB> --offline
+##
+## Example:
+## python3 sweep.py particle "/media/HDD/thivin/ITC/Output/Sweep" "tnse3d.dat" --grid "RE_NR=1000,3745" --args "1000,../Siminhale_Fluid_Solutions/" --cpus 16
+##
+## Every combination of the grid gets a directory <sweepDirectory>/run_<i> with the derived dat file, the
+## executable is started there and its output is written to stdout.txt. At most min(cpus / jobCpus,
+## memory / jobMemory) jobs run at the same time. sweep.csv lists the run directories and their values.
+## Entries of --args that name an existing path relative to the launch directory are made absolute, since
+## the executable runs in run_<i>; other relative paths are resolved by the executable against run_<i>.
+
+import os
+import argparse
+import itertools
+import subprocess
+import pandas as pd
+
+from os.path import join, abspath, basename, exists
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from track import Simulation, FluidSimulation, ParticleSimulation
+
+def parseGrid(grid):
+    # ["RE_NR=1000,3745", ...] -> {"RE_NR": ["1000", "3745"], ...}
+    values = {}
+    for item in grid:
+        key, options = item.split("=", 1)
+        values[key.strip()] = [option.strip() for option in options.split(",")]
+    return values
+
+def writeDatFile(baseDatFile, datFile, values):
+    # Copy of the base dat file with the values of the given keys replaced (or appended)
+    with open(baseDatFile, "r") as f:
+        lines = f.readlines()
+    remaining = dict(values)
+    for i, line in enumerate(lines):
+        key = line.split(":")[0].strip()
+        if ":" in line and key in remaining:
+            lines[i] = f"{key}: {remaining.pop(key)}\n"
+    lines += [f"{key}: {value}\n" for key, value in remaining.items()]
+    with open(datFile, "w") as f:
+        f.writelines(lines)
+
+def linkInputs(baseDirectory, runDirectory, parameters):
+    # The mesh files are referred to relative to the dat file, link them into the run directory
+    for key in ["GEOFILE", "BNDFILE"]:
+        name = parameters.get(key)
+        if name and not os.path.isabs(name) and exists(join(baseDirectory, name)) and not exists(join(runDirectory, name)):
+            os.makedirs(os.path.dirname(join(runDirectory, name)) or runDirectory, exist_ok=True)
+            os.symlink(abspath(join(baseDirectory, name)), join(runDirectory, name))
+
+def runJob(command, args, runDirectory):
+    with open(join(runDirectory, "stdout.txt"), "w") as f:
+        return subprocess.run([command] + args, cwd=runDirectory, stdout=f, stderr=subprocess.STDOUT).returncode
+
+class Sweep:
+    def __init__(self, experiment, sweepDirectory, baseDatFile, grid, command, args, slots=1, offline=False):
+        self.simulation = ParticleSimulation if experiment == "particle" else FluidSimulation
+        # the executable runs in the run directory, the dat file path must not depend on the launch directory
+        self.sweepDirectory = abspath(sweepDirectory)
+        self.baseDatFile = baseDatFile
+        self.grid = grid
+        self.command = abspath(command)
+        self.args = args
+        self.slots = slots
+        self.offline = offline
+
+    def prepare(self):
+        # Write the derived dat files, returns [(run directory, dat file, values)]
+        runs = []
+        keys = list(self.grid)
+        baseDirectory = os.path.dirname(abspath(self.baseDatFile))
+        for i, combination in enumerate(itertools.product(*self.grid.values())):
+            values = dict(zip(keys, combination))
+            runDirectory = join(self.sweepDirectory, f"run_{i}")
+            os.makedirs(runDirectory, exist_ok=True)
+            datFile = join(runDirectory, basename(self.baseDatFile))
+            writeDatFile(self.baseDatFile, datFile, values)
+            linkInputs(baseDirectory, runDirectory, Simulation.parseDatFile(datFile))
+            runs.append((runDirectory, datFile, values))
+        pd.DataFrame([dict(directory=run[0], **run[2]) for run in runs]).to_csv(join(self.sweepDirectory, "sweep.csv"), index=False)
+        return runs
+
+    def run(self):
+        runs = self.prepare()
+        print("Runs: ", len(runs), " Concurrent jobs: ", self.slots)
+        failed = []
+        with ThreadPoolExecutor(max_workers=self.slots) as pool:
+            futures = {pool.submit(runJob, self.command, [datFile] + self.args, runDirectory): (runDirectory, datFile, values)
+                       for runDirectory, datFile, values in runs}
+            # the runs are logged one at a time from this thread, the solvers keep running meanwhile
+            for future in as_completed(futures):
+                runDirectory, datFile, values = futures[future]
+                name = " ".join(f"{key}={value}" for key, value in values.items())
+                returnCode = future.result()
+                if returnCode != 0:
+                    print(f"Run {name} failed with return code {returnCode}, see {join(runDirectory, 'stdout.txt')}")
+                    failed.append(runDirectory)
+                    continue
+                # one run failing to log does not stop the others
+                try:
+                    self.simulation(runDirectory, datFile, "False", self.command, [datFile] + self.args, runName="Sweep " + name,
+                                    interactive=False, offline=self.offline, solverOutput=join(runDirectory, "stdout.txt"))
+                except Exception as e:
+                    print(f"Logging run {name} failed: {e!r}")
+                    failed.append(runDirectory)
+        return failed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a parameter sweep concurrently and track the runs using MLflow")
+    parser.add_argument("experiment", help="the type of experiment to run/track: particle or fluid")
+    parser.add_argument("sweepDirectory", help="the directory the runs are created in")
+    parser.add_argument("datFile", help="the base dat file")
+    parser.add_argument("--grid", help="KEY=v1,v2,... values of one dat parameter, repeat for more", action="append", required=True)
+    parser.add_argument("--executable", help="the executable name, next to the base dat file", default="parmoon_3D_SEQUENTIAL.exe")
+    parser.add_argument("--args", help="comma separated extra arguments", default="")
+    parser.add_argument("--cpus", help="the number of cpus to use", type=int, default=os.cpu_count())
+    parser.add_argument("--jobCpus", help="the number of cpus of one job", type=int, default=1)
+    parser.add_argument("--memory", help="the memory to use in GB, 0 -> no limit", type=float, default=0)
+    parser.add_argument("--jobMemory", help="the memory of one job in GB", type=float, default=1)
+    parser.add_argument("--offline", help="record the runs only in the local run store", action="store_true")
+    args = parser.parse_args()
+
+    slots = max(args.cpus // args.jobCpus, 1)
+    if args.memory > 0:
+        slots = max(min(slots, int(args.memory // args.jobMemory)), 1)
+    commandArgs = [] if len(args.args) == 0 else args.args.split(",")
+    commandArgs = [abspath(arg) if exists(arg) else arg for arg in commandArgs]
+
+    command = join(os.path.dirname(abspath(args.datFile)), args.executable)
+    sweep = Sweep(args.experiment, args.sweepDirectory, args.datFile, parseGrid(args.grid), command, commandArgs, slots, args.offline)
+    failed = sweep.run()
+    if failed:
+        print("Failed runs: ", len(failed))
@@ -1,25 +1,41 @@
 ## This script is used to run a particle flow simulation and track the results using MLflow
 ##
 ## Usage:
-## python track.py <experiment> <outputDirectory> <datFile> --runShell <True/False> --executable <executableName> --args <comma separated extra arguments>
+## python track.py <experiment> <outputDirectory> <datFile> --runShell <True/False> --executable <executableName> --args <comma separated extra arguments> --nonInteractive --offline --archive --profile
 ##
 ## Examples:
 ## python3 track.py fluid "/media/HDD/thivin/ITC/Output/Siminhale_Fluid_Solutions" "tnse3d.dat"
 ## python3 track.py particle "/media/HDD/thivin/ITC/Output/Siminhale_Particle_Solutions" "tnse3d.dat" --args "1000,../Siminhale_Fluid_Solutions/"
 
 import os
+import re
 import sys
+import json
+import time
+import uuid
 import mlflow
 import argparse
 import subprocess
 
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
 
 from os.path import join
 from datetime import datetime
+from contextlib import nullcontext
 from tqdm import tqdm
+from mlflow.entities import Metric
+from segments import classifyFrame, classifyBoxes
+from artifacts import ArtifactUploader, defaultIndex, fileHash
+from runstore import RunStore
+from chunkstore import ChunkStore, manifestHash
+from solutions import directoryStats
+from deltaarchive import SnapshotArchive
+from stagetimer import StageTimer
+from render import saveFigure, percent
+from snapshots import loadSnapshot
+from labelcache import LabelCache, defaultCache
+from deposition import DepositionCounts
 
 class Simulation:
     experimentName = "Simulation"
@@ -28,23 +44,69 @@ class Simulation:
     uiPassword = "siminhale"
     parameters = {}
     metrics = ["TIMESTEPLENGTH", "RE_NR"]
-
-    def __init__(self, outputDirectory, datFile, runShell, command, args, runName=None):
+    uploadWorkers = 8
+    uploadRetries = 3
+    artifactIndex = defaultIndex
+    # every run is also recorded in this local database, offline runs only there (see runstore.py)
+    runStore = join(os.path.expanduser("~"), ".siminhale", "runs.db")
+    # Solution_*.bin files are stored by content here and only their new chunks are uploaded (see chunkstore.py),
+    # None -> upload the files as they are
+    solutionStore = join(os.path.expanduser("~"), ".siminhale", "solutions")
+    solutionChunkSize = 4 << 20
+    # with --archive the snapshot series are uploaded as keyframes and deltas (see deltaarchive.py)
+    archiveKeyInterval = 10
+    archiveWorkers = 4
+    # solver stdout lines logged as step-indexed metrics while it runs: metric -> pattern with the value as group 1,
+    # every "time" match starts the next step
+    stdoutMetrics = {
+        "time": r"CURRENT TIME:\s*([-+0-9.eE]+)",
+        "residual": r"[Rr]esidual[^:=\n]*[:=]\s*([-+0-9.eE]+)",
+        "solverTime": r"[Tt]ime (?:for|taken)[^:=\n]*[:=]\s*([-+0-9.eE]+)",
+    }
+    metricBatchSize = 200
+    metricFlushSeconds = 10
+    # see render.py, None -> always draw the plots
+    figureStyle = "plain"
+    figureCache = join(os.path.expanduser("~"), ".siminhale", "figures")
+    # see labelcache.py, None -> always classify the particles
+    labelCache = defaultCache
+
+    def __init__(self, outputDirectory, datFile, runShell, command, args, runName=None, interactive=True, offline=False, archive=False,
+                 profile=False, solverOutput=None):
+        self.interactive = interactive
+        self.timer = StageTimer(profile)
+        self.online = not offline
+        self.archive = archive
+        self.store = RunStore(self.runStore)
         dt_string = self.startTimer()
-        mlflow.set_experiment(self.experimentName)
-        # mlflow.set_tracking_uri(self.trackingUri)
-        # mlflow.set_credentials(self.uiUsername, self.uiPassword)
-        # print(mlflow.get_tracking_uri())
-
-        with mlflow.start_run() as run:
-            mlflow.set_tag("mlflow.runName", runName if runName else "Run " + dt_string)
-            self.parameters = self.parseDatFile(datFile)
+        if self.online:
+            mlflow.set_experiment(self.experimentName)
+            # mlflow.set_tracking_uri(self.trackingUri)
+            # mlflow.set_credentials(self.uiUsername, self.uiPassword)
+            # print(mlflow.get_tracking_uri())
+
+        with mlflow.start_run() if self.online else nullcontext() as run:
+            self.runId = run.info.run_id if self.online else uuid.uuid4().hex
+            runName = runName if runName else "Run " + dt_string
+            self.store.addRun(self.runId, self.experimentName, runName, os.path.abspath(outputDirectory), self.online)
+            self.client = mlflow.tracking.MlflowClient() if self.online else None
+            self.uploader = ArtifactUploader(self.client, self.runId, self.artifactIndex, self.uploadWorkers, self.uploadRetries)
+            if self.online:
+                mlflow.set_tag("mlflow.runName", runName)
+            with self.timer.stage("parseDatFile"):
+                self.parameters = self.parseDatFile(datFile)
             self.outputDirectory = outputDirectory
             if (runShell == "True"):
-                self.runShell(command, args)
+                with self.timer.stage("runShell"):
+                    self.runShell(command, args)
+            elif solverOutput:
+                # the solver ran elsewhere (sweep.py), its output is parsed and uploaded the same way
+                with self.timer.stage("solverOutput"):
+                    self.logSolverOutput(solverOutput)
             else:
                 print("Skipping the run command options")
             self.log(args)
+            self.logStages()
 
         self.endTimer()
 
@@ -58,44 +120,120 @@ class Simulation:
         print("Mlflow run ended: " + end.strftime("%H:%M:%S"))
         print("Mlflow run duration: " + str(end - self.start).split(".")[0])
 
+    # the run store gets everything, MLflow only while online
+    def setTag(self, key, value):
+        self.store.setTags(self.runId, {key: value})
+        if self.online:
+            mlflow.set_tag(key, value)
+
+    def logParam(self, key, value):
+        self.store.logParams(self.runId, {key: value})
+        if self.online:
+            mlflow.log_param(key, value)
+
+    def logMetric(self, key, value):
+        self.logMetricBatch([(key, value, 0, int(time.time() * 1000))])
+
+    def logMetricBatch(self, batch):
+        # batch: [(key, value, step, timestamp)]
+        self.store.logMetrics(self.runId, batch)
+        if self.online:
+            for start in range(0, len(batch), self.metricBatchSize):
+                self.client.log_batch(self.runId, metrics=[Metric(key, value, timestamp, step)
+                                                           for key, value, step, timestamp in batch[start:start + self.metricBatchSize]])
+
     def logArgs(self, args=[]):
         if (len(args) < 2):
             return
-        mlflow.log_param("Extra Args", args[1:])
+        self.logParam("Extra Args", args[1:])
 
     def logParameters(self):
         print("Logging Parameters:")
-        for key, value in tqdm(self.parameters.items()):
-            mlflow.log_param(key, value)
+        self.store.logParams(self.runId, self.parameters)
+        if self.online:
+            for key, value in tqdm(self.parameters.items()):
+                mlflow.log_param(key, value)
 
     def logMetrics(self):
         print("Logging Metrics:")
-        for i in tqdm(range(len(self.metrics))):
-            mlflow.log_metric(self.metrics[i], self.parameters[self.metrics[i]])
+        self.logMetricBatch([(key, self.parameters[key], 0, int(time.time() * 1000)) for key in self.metrics])
 
     def logArtifacts(self):
         meshFile = self.parameters["GEOFILE"] if int(self.parameters["MESH_TYPE"]) == 1 else self.parameters["BNDFILE"]
         outFile = self.parameters["OUTFILE"]
         print("Logging Artifacts: Mesh file")
-        mlflow.log_artifact(join(self.outputDirectory, meshFile) , artifact_path="Input")
+        self.uploader.add(join(self.outputDirectory, meshFile), "Input")
         print("Logging Artifacts: Output file")
-        mlflow.log_artifact(join(self.outputDirectory, outFile)  , artifact_path="Output")
+        self.uploader.add(join(self.outputDirectory, outFile), "Output")
 
         if (int(self.parameters["WRITE_VTK"]) == 1):
             print("Logging Artifacts: VTK")
             vtkDir = self.parameters["OUTPUTDIR"]
             # mlflow.log_artifacts(join(self.outputDirectory, vtkDir), artifact_path="Output")
             files = os.listdir(join(self.outputDirectory, vtkDir))
-            for i in tqdm(range(len(files))):
-                mlflow.log_artifact(join(self.outputDirectory, vtkDir, files[i]), artifact_path=join("Output", vtkDir))
+            if self.archive:
+                self.logArchive([join(self.outputDirectory, vtkDir, f) for f in files], vtkDir)
+                return
+            for i in range(len(files)):
+                self.uploader.add(join(self.outputDirectory, vtkDir, files[i]), join("Output", vtkDir))
+
+    def logSolutions(self, paths, manifestName):
+        store = ChunkStore(self.solutionStore, self.solutionChunkSize)
+        manifest, written = store.putFiles(paths, self.uploadWorkers)
+        print("Solution bytes new to the store: ", written, " of ", sum(entry["size"] for entry in manifest))
+        chunks = {chunk for entry in manifest for chunk in entry["chunks"]}
+        for chunk in sorted(chunks):
+            # a chunk's name is its sha256
+            self.uploader.add(store.chunkPath(chunk), "Output/Solutions/chunks", chunk)
+        manifestPath = join(self.outputDirectory, manifestName)
+        with open(manifestPath, "w") as f:
+            json.dump(manifest, f, indent=2)
+        self.uploader.add(manifestPath, "Output/Solutions")
+        self.setTag("solutionsManifestHash", manifestHash(manifest))
+
+    def logArchive(self, paths, name):
+        # a fresh archive per run, a rerun in the same output directory must not upload the earlier run's
+        archive = SnapshotArchive(join(self.outputDirectory, "archive", self.runId, name), self.archiveKeyInterval, workers=self.archiveWorkers)
+        try:
+            read, stored = archive.add(paths)
+        finally:
+            archive.close()
+        print(f"Archived {name}: {read} bytes -> {stored} bytes")
+        for path in archive.files():
+            self.uploader.add(path, join("Output/Archive", name))
 
     def log(self, args):
-        self.logArgs(args)
-        self.logParameters()
-        self.logMetrics()
-        self.logArtifacts()
-
-    def parseDatFile(self, filePath):
+        with self.timer.stage("logArgs"):
+            self.logArgs(args)
+        with self.timer.stage("logParameters"):
+            self.logParameters()
+        with self.timer.stage("logMetrics"):
+            self.logMetrics()
+        with self.timer.stage("logArtifacts"):
+            self.logArtifacts()
+        self.store.addArtifacts(self.runId, self.uploader.queue)
+        if self.online:
+            with self.timer.stage("upload"):
+                self.uploader.upload()
+        else:
+            print("Offline run ", self.runId, ": artifacts recorded in the run store, upload them with runstore.py sync")
+
+    def logStages(self):
+        # stage timings as metrics, and the profile of the slowest stage when profiling
+        print("Stages:")
+        self.timer.report()
+        timestamp = int(time.time() * 1000)
+        self.logMetricBatch([(key, value, 0, timestamp) for key, value in self.timer.metrics()])
+        profilePath = self.timer.dumpProfile(self.outputDirectory)
+        if profilePath:
+            print("Profile of the slowest stage: ", profilePath)
+            self.setTag("Slowest stage", self.timer.slowest())
+            self.store.addArtifacts(self.runId, [(profilePath, "Profile")])
+            if self.online:
+                self.client.log_artifact(self.runId, profilePath, "Profile")
+
+    @staticmethod
+    def parseDatFile(filePath):
         values = {}
         with open(filePath, "r") as f:
             lines = f.readlines()
@@ -110,67 +248,158 @@ class Simulation:
                 values[key] = value.strip()
         return values
 
-    # run the executable and log the output as an artifact
+    # run the executable, stream its output to stdout.txt and queue the output as an artifact
     def runShell(self, command, args):
-        reply = input(f"Are you sure you want to run the command \"{self.command} {self.args}\"?  (y/n)")
-        if(reply == "y"):
-            process = subprocess.Popen([self.command] + self.args, stdout=subprocess.PIPE, universal_newlines=True)
-            stdout, _ = process.communicate()
-
-            # Log the standard output as a file artifact
-            stdoutPath = join(self.outputDirectory, "stdout.txt")
-            with open(stdoutPath, "w") as f:
-                f.write(stdout)
-                mlflow.log_artifact(stdoutPath, artifact_path="Output")
+        if self.interactive:
+            reply = input(f"Are you sure you want to run the command \"{command} {args}\"?  (y/n)")
+            if (reply != "y"):
+                return
+
+        stdoutPath = join(self.outputDirectory, "stdout.txt")
+        with open(stdoutPath, "w", buffering=1) as f:
+            process = subprocess.Popen([command] + args, stdout=subprocess.PIPE, universal_newlines=True, bufsize=1)
+            self.logStdoutMetrics(process.stdout, f)
+            process.wait()
+
+        self.setTag("Solver return code", process.returncode)
+        self.uploader.add(stdoutPath, "Output")
+
+    def logSolverOutput(self, stdoutPath):
+        # the metrics of a finished solver's output file, which is queued as an artifact
+        with open(stdoutPath, "r", errors="replace") as f:
+            self.logStdoutMetrics(f)
+        self.uploader.add(stdoutPath, "Output")
+
+    def logStdoutMetrics(self, lines, copy=None):
+        # log the stdoutMetrics of the solver output lines in batches, every line is written to copy if given
+        patterns = {key: re.compile(pattern) for key, pattern in self.stdoutMetrics.items()}
+        batch = []
+        step = 0
+        lastFlush = time.monotonic()
+        for line in lines:
+            if copy:
+                copy.write(line)
+            for key, pattern in patterns.items():
+                match = pattern.search(line)
+                if match is None:
+                    continue
+                try:
+                    value = float(match.group(1))
+                except ValueError:
+                    continue
+                if key == "time":
+                    step += 1
+                batch.append((key, value, step, int(time.time() * 1000)))
+            if len(batch) >= self.metricBatchSize or (batch and time.monotonic() - lastFlush >= self.metricFlushSeconds):
+                self.logMetricBatch(batch)
+                batch = []
+                lastFlush = time.monotonic()
+        if batch:
+            self.logMetricBatch(batch)
 
 class FluidSimulation (Simulation):
     experimentName = "Fluid Simulation"
     metrics = ["TIMESTEPLENGTH", "RE_NR"]
+    # velocity statistics per timestep from the Solution_<solutionKind>_<step>.bin files (see solutions.py)
+    solutionKind = "u"
+    solutionComponents = 3
+    solutionStatsWorkers = 4
+
+    def logMetrics(self):
+        Simulation.logMetrics(self)
+        print("Logging Metrics: Velocity statistics")
+        try:
+            stats = directoryStats(self.outputDirectory, self.solutionKind, self.solutionComponents, self.solutionStatsWorkers)
+        except ValueError as e:
+            print("Skipping the velocity statistics: ", e)
+            return
+        timestamp = int(time.time() * 1000)
+        batch = [(key, float(row[key]), int(row["step"]), timestamp)
+                 for _, row in stats.iterrows() for key in stats.columns if key != "step" and not pd.isna(row[key])]
+        if batch:
+            self.logMetricBatch(batch)
 
     def logArtifacts(self):
         Simulation.logArtifacts(self)
 
         print("Logging Artifacts: Solution files")
         files = [f for f in os.listdir(self.outputDirectory) if f.startswith("Solution_") and f.endswith(".bin")]
-        for i in tqdm(range(len(files))):
+        if self.archive:
+            self.logArchive([join(self.outputDirectory, f) for f in files], "Solutions")
+            return
+        if self.solutionStore:
+            self.logSolutions([join(self.outputDirectory, f) for f in files], "solutions.json")
+            return
+        for i in range(len(files)):
             type = files[i].split("_")[1].upper()
-            mlflow.log_artifact(join(self.outputDirectory, files[i]), artifact_path=f"Output/Solutions/{type}")
+            self.uploader.add(join(self.outputDirectory, files[i]), f"Output/Solutions/{type}")
             
 class ParticleSimulation (Simulation):
     experimentName = "Particle Simulation"
     metrics = ["TIMESTEPLENGTH", "RE_NR"]
 
     def logArgs(self, args):
-        mlflow.set_tag("numberOfParticles", args[1])
-        mlflow.set_tag("inputFluidSolutions", args[2])
+        self.setTag("numberOfParticles", args[1])
+        self.setTag("inputFluidSolutions", args[2])
         if (len(args) > 3):
-            mlflow.log_param("Extra Args", args[3:])
+            self.logParam("Extra Args", args[3:])
+        self.referenceFluidSolutions(os.path.abspath(join(self.outputDirectory, args[2])))
+
+    def referenceFluidSolutions(self, inputDirectory):
+        # point to the fluid run that stored the input solutions, the solutions are never copied or uploaded
+        fluidRun = self.store.findRun(FluidSimulation.experimentName, inputDirectory)
+        if fluidRun:
+            self.setTag("inputFluidRun", fluidRun)
+        elif os.path.isdir(inputDirectory):
+            # no tracked fluid run: record where the solutions are and a hash of their content, which
+            # matches the solutionsManifestHash tag of a fluid run that stored the same files
+            files = [f for f in os.listdir(inputDirectory) if f.startswith("Solution_") and f.endswith(".bin")]
+            print("No fluid run found for ", inputDirectory, ", tagging the input solutions")
+            self.setTag("inputFluidDirectory", inputDirectory)
+            self.setTag("inputSolutionsManifestHash", manifestHash([{"file": f, "sha256": fileHash(join(inputDirectory, f))} for f in files]))
 
     def logArtifacts(self):
         Simulation.logArtifacts(self)
 
         print("Logging Artifacts: Solution files")
         files = [f for f in os.listdir(self.outputDirectory) if f.startswith("siminhale_") and f.endswith(".csv")]
-        for i in tqdm(range(len(files))):
-            mlflow.log_artifact(join(self.outputDirectory, files[i]), artifact_path=f"Output/Solutions")
+        if self.archive:
+            self.logArchive([join(self.outputDirectory, f) for f in files], "Solutions")
+        else:
+            for i in range(len(files)):
+                self.uploader.add(join(self.outputDirectory, files[i]), f"Output/Solutions")
 
         csvFile = join(self.outputDirectory, files[-1])
         targetFile = join(self.outputDirectory, "deposition_fraction.")
         extensions = ['png', 'pdf', 'ps', 'eps', 'svg']
-        particlesTotal, particlesDeposited, particlesEscaped, particlesStagnant, particlesErrored, files = self.plotDepositionFraction(csvFile, targetFile, extensions)
-        mlflow.set_tag("Total Particles", particlesTotal)
-        mlflow.set_tag("Deposited Particles", particlesDeposited)
-        mlflow.set_tag("Escaped Particles", particlesEscaped)
-        mlflow.set_tag("Stagnant Particles", particlesStagnant)
-        mlflow.set_tag("Errored Particles", particlesErrored)
+        with self.timer.stage("plotDepositionFraction"):
+            particlesTotal, particlesDeposited, particlesEscaped, particlesStagnant, particlesErrored, files = self.plotDepositionFraction(csvFile, targetFile, extensions)
+        self.setTag("Total Particles", particlesTotal)
+        self.setTag("Deposited Particles", particlesDeposited)
+        self.setTag("Escaped Particles", particlesEscaped)
+        self.setTag("Stagnant Particles", particlesStagnant)
+        self.setTag("Errored Particles", particlesErrored)
+        if particlesTotal > 0:
+            self.logMetric("Deposition percentage", particlesDeposited / particlesTotal * 100)
 
         print("Logging Artifacts: Deposition Fraction Plots")
-        for i in tqdm(range(len(files))):
-            mlflow.log_artifact(join(self.outputDirectory, files[i]), artifact_path=f"Output/Plots")
+        # saveFigure returns the paths of the files, not names in the output directory
+        for i in range(len(files)):
+            self.uploader.add(files[i], f"Output/Plots")
 
     def plotDepositionFraction(self, csvFile, targetFile, extensions):
-        df = pd.read_csv(csvFile)
-        df['section'] = df.apply(lambda row: self.categorise(row), axis=1)
+        df = loadSnapshot(csvFile, ["x", "y", "z", "deposition", "escaped", "error"])
+        cache = LabelCache(self.labelCache) if self.labelCache else None
+        cacheKey = cache.key(csvFile, "boxes") if cache else None
+        labels = cache.labels(cacheKey) if cache and cache.counts(cacheKey) else None
+        if labels is not None:
+            df['section'] = labels
+        else:
+            df['section'] = self.categorise(df)
+            if cache:
+                counts = DepositionCounts()
+                counts.add(df)
+                cache.put(cacheKey, df['section'].to_numpy(), counts)
 
         df_grouped = pd.DataFrame(df[(df['deposition'] == 1) & (df['escaped'] == 0)]['section'])
         df_grouped['count'] = 1
@@ -179,16 +408,10 @@ class ParticleSimulation (Simulation):
         df_grouped['Deposition fraction'] = (df_grouped['count'] / particles) * 100
         df_grouped.sort_values(by=['section'], inplace=True)
 
-        plt.plot(df_grouped['section'], df_grouped['Deposition fraction'], marker="x")
-        plt.xlabel("Segments")
-        plt.ylabel("Deposition fraction (%)")
-        plt.yscale("log")
-        plt.xticks(list(range(0, 22, 2)))
-        plt.yticks([0.001, 0.01, 0.1, 1, 10, 100])
-
-        files = [targetFile + ext for ext in extensions]
-        for file in files:
-            plt.savefig(file, dpi=300)
+        spec = {"series": [{"x": df_grouped['section'].tolist(), "y": df_grouped['Deposition fraction'].tolist(), "marker": "x"}],
+                "xlabel": "Segments", "ylabel": f"Deposition fraction ({percent(self.figureStyle)})", "yscale": "log",
+                "xticks": list(range(0, 22, 2)), "yticks": [0.001, 0.01, 0.1, 1, 10, 100]}
+        files = saveFigure(spec, targetFile, extensions, self.figureStyle, self.figureCache)
 
         particlesTotal = df.shape[0]
         particlesDeposited = particles
@@ -197,53 +420,8 @@ class ParticleSimulation (Simulation):
         particlesErrored = df[df['error'] == 1].shape[0]
         return particlesTotal, particlesDeposited, particlesEscaped, particlesStagnant, particlesErrored, files
 
-    def categorise(self, row):  
-        if   row['z'] >= -0.06:
-            return 1
-        elif row['z'] >= -0.180 and row['x'] >= -0.016 and row['x'] < 0.002:
-            return 2
-        elif row['z'] >= -0.200 and row['x'] >= -0.018 and row['x'] < 0.002:
-            return 3
-        elif row['z'] >= -0.216 and row['x'] >= -0.006 and row['x'] < 0.030:
-            return 4
-        elif row['z'] >= -0.220 and row['x'] >=  0.025 and row['x'] < 0.037:
-            return 5
-        elif row['z'] >= -0.228 and row['z'] < -0.215 and row['x'] >= 0.031 and row['x'] < 0.042:
-            return 6
-        elif row['z'] >= -0.217 and row['z'] < -0.207 and row['x'] >= 0.033 and row['x'] < 0.047:
-            return 7
-        elif row['z'] >= -0.207 and row['z'] < -0.187 and row['x'] >= -0.026 and row['x'] < -0.007:
-            return 8
-        elif row['z'] >= -0.206 and row['z'] < -0.190 and row['x'] >= -0.037 and row['x'] < -0.023:
-            return 9
-        elif row['z'] >= -0.225 and row['z'] < -0.205 and row['x'] >= -0.034 and row['x'] < -0.014:
-            return 10
-        elif row['z'] >= -0.230 and row['z'] < -0.221 and row['x'] >= -0.049 and row['x'] < -0.031:
-            return 11
-        elif row['z'] >= -0.246 and row['z'] < -0.226 and row['x'] >= -0.042 and row['x'] < -0.032:
-            return 12
-        elif row['z'] >= -0.210 and row['z'] < -0.150 and row['x'] >= 0.041 and row['x'] < 0.090:
-            return 13
-        elif row['z'] >= -0.260 and row['z'] < -0.220 and row['x'] >= 0.011 and row['x'] < 0.046:
-            return 14
-        elif row['z'] >= -0.310 and row['z'] < -0.230 and row['x'] >= 0.033 and row['x'] < 0.083:
-            return 15
-        elif row['z'] >= -0.245 and row['z'] < -0.205 and row['x'] >= 0.047 and row['x'] < 0.111:
-            return 16
-        elif row['z'] >= -0.260 and row['z'] < -0.222 and row['x'] >= -0.110 and row['x'] < -0.047:
-            return 17
-        elif row['z'] >= -0.310 and row['z'] < -0.230 and row['x'] >= -0.066 and row['x'] < -0.020 and row['y'] >= 0.080 and row['y'] < 0.120:
-            return 18
-        elif row['z'] >= -0.200 and row['z'] < -0.140 and row['x'] >= -0.110 and row['x'] < -0.040 and row['y'] >= 0.080 and row['y'] < 0.134:
-            return 19
-        elif row['z'] >= -0.245 and row['z'] < -0.225 and row['x'] >= -0.100 and row['x'] < -0.044 and row['y'] >= 0.095 and row['y'] < 0.110:
-            return 20
-        elif row['z'] >= -0.230 and row['z'] < -0.150 and row['x'] >= -0.090 and row['x'] < -0.020 and row['y'] >= 0.110 and row['y'] < 0.210:
-            return 21
-        elif row['z'] >= -0.290 and row['z'] < -0.220 and row['x'] >= -0.070 and row['x'] < -0.025 and row['y'] >= 0.120 and row['y'] < 0.180:
-            return 22
-        else:
-            return -1
+    def categorise(self, df):
+        return classifyFrame(df, classifyBoxes)
 
 def setupArgs():
     parser = argparse.ArgumentParser(description=f"Run/Track a simulation using MLflow")
@@ -253,6 +431,10 @@ def setupArgs():
     parser.add_argument("--runShell", help="pass True to run the executable", default="False")
     parser.add_argument("--executable", help="the executable name", default="parmoon_3D_SEQUENTIAL.exe")
     parser.add_argument("--args", help="comma separated extra arguments", default="") # pass as space separated values to the main command
+    parser.add_argument("--nonInteractive", help="run the executable without asking for confirmation", action="store_true")
+    parser.add_argument("--offline", help="record the run only in the local run store, sync it later with runstore.py", action="store_true")
+    parser.add_argument("--archive", help="upload the snapshot series as keyframes and compressed deltas", action="store_true")
+    parser.add_argument("--profile", help="profile the stages and upload the profile of the slowest one", action="store_true")
 
     args = parser.parse_args()
     outputDirectory = args.outputDirectory
@@ -261,15 +443,15 @@ def setupArgs():
     command = join(outputDirectory, args.executable)
     commandArgs = [] if len(args.args) == 0 else args.args.split(",")
     commandArgs.insert(0, datFile)
-    return args.experiment, outputDirectory, datFile, runShell, command, commandArgs
+    return args.experiment, outputDirectory, datFile, runShell, command, commandArgs, not args.nonInteractive, args.offline, args.archive, args.profile
 
 if __name__== "__main__":
-    experiment, *args = setupArgs()
+    experiment, *args, interactive, offline, archive, profile = setupArgs()
 
     if (experiment == "particle"):
-        ParticleSimulation(*args)
+        ParticleSimulation(*args, interactive=interactive, offline=offline, archive=archive, profile=profile)
     elif (experiment == "fluid"):
-        FluidSimulation(*args)
+        FluidSimulation(*args, interactive=interactive, offline=offline, archive=archive, profile=profile)
     else:
         print("Invalid experiment type")
 
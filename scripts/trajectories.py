@@ -0,0 +1,174 @@
+# Particle trajectories of a siminhale_<index>.csv snapshot series in memory-mapped arrays
+# Usage: python trajectories.py convert <folder containing particles csv> <store> --workers <processes> --particleChunk <particles> --stepChunk <snapshots>
+#        python trajectories.py particle <store> <particle>
+#        python trajectories.py snapshot <store> <snapshot index>
+# Particles are identified by their row in the snapshots (like incremental.py), particles injected later
+# are missing from the earlier snapshots. The store holds positions.npy (float32 xyz) and status.npy
+# (uint8 bits: present, deposited, escaped, error), both laid out as tiles of particleChunk particles x
+# stepChunk snapshots, so one particle's trajectory and one snapshot's cloud each read only their tiles.
+# The step tiles are converted in parallel, each writes its tiles once; a worker holds one snapshot or one tile in memory.
+
+import os
+import json
+import shutil
+import argparse
+import numpy as np
+import pandas as pd
+from os.path import join
+from concurrent.futures import ProcessPoolExecutor
+
+from snapshots import snapshotFiles, snapshotIndex
+
+present, deposited, escaped, errored = 1, 2, 4, 8
+
+def countRows(filename, blockSize=1 << 20):
+    # data rows of a csv with a header line
+    lines, last = 0, b"\n"
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(blockSize), b""):
+            lines += block.count(b"\n")
+            last = block
+    # a last line without a newline
+    lines += not last.endswith(b"\n")
+    return max(lines - 1, 0)
+
+def tileShape(particles, steps, particleChunk, stepChunk):
+    return (-(-particles // particleChunk), -(-steps // stepChunk), particleChunk, stepChunk)
+
+def readSnapshot(filename, particles):
+    # (positions (n, 3) float32, status bits (n,)) of one snapshot
+    df = pd.read_csv(filename, usecols=["x", "y", "z", "deposition", "escaped", "error"])
+    if len(df) > particles:
+        raise ValueError(f"{filename} has {len(df)} particles, the store has room for {particles}")
+    bits = (present | deposited * (df["deposition"].to_numpy() == 1) | escaped * (df["escaped"].to_numpy() == 1)
+            | errored * (df["error"].to_numpy() == 1)).astype(np.uint8)
+    return df[["x", "y", "z"]].to_numpy(np.float32), bits
+
+def convertTile(path, files, tile):
+    # Write the snapshots of one step tile (stepChunk consecutive snapshots) into the store.
+    # Each snapshot is first written as a plain column file, then every tile of the step tile is
+    # assembled in memory from the column files and written once, so memory holds one snapshot or one tile.
+    with open(join(path, "meta.json.tmp"), "r") as f:
+        meta = json.load(f)
+    positions = np.load(join(path, "positions.npy"), mmap_mode="r+")
+    status = np.load(join(path, "status.npy"), mmap_mode="r+")
+    pTiles, _, particleChunk, stepChunk = status.shape
+
+    columnPath = join(path, f"columns_{tile}")
+    os.makedirs(columnPath, exist_ok=True)
+    try:
+        for offset, filename in enumerate(files):
+            xyz, bits = readSnapshot(filename, meta["particles"])
+            np.save(join(columnPath, f"xyz_{offset}.npy"), xyz)
+            np.save(join(columnPath, f"bits_{offset}.npy"), bits)
+            del xyz, bits
+        columns = [(np.load(join(columnPath, f"xyz_{offset}.npy"), mmap_mode="r"),
+                    np.load(join(columnPath, f"bits_{offset}.npy"), mmap_mode="r")) for offset in range(len(files))]
+
+        for particleTile in range(pTiles):
+            start = particleTile * particleChunk
+            xyzTile = np.zeros((particleChunk, stepChunk, 3), dtype=np.float32)
+            bitsTile = np.zeros((particleChunk, stepChunk), dtype=np.uint8)
+            for offset, (xyz, bits) in enumerate(columns):
+                rows = max(min(len(bits) - start, particleChunk), 0)
+                xyzTile[:rows, offset] = xyz[start:start + rows]
+                bitsTile[:rows, offset] = bits[start:start + rows]
+            positions[particleTile, tile] = xyzTile
+            status[particleTile, tile] = bitsTile
+        positions.flush()
+        status.flush()
+    finally:
+        shutil.rmtree(columnPath, ignore_errors=True)
+    return len(files)
+
+def convert(folder, path, workers=4, particleChunk=4096, stepChunk=64):
+    # Build the store from every snapshot of the folder, the last snapshot has the most particles
+    files = snapshotFiles(folder)
+    if not files:
+        raise ValueError(f"No snapshots in {folder}")
+    particles = countRows(join(folder, files[-1]))
+    # no tile wider than the series, the unused columns would still be written
+    stepChunk = min(stepChunk, len(files))
+    shape = tileShape(particles, len(files), particleChunk, stepChunk)
+    os.makedirs(path, exist_ok=True)
+    if os.path.exists(join(path, "meta.json")):
+        os.remove(join(path, "meta.json"))
+    meta = {"particles": particles, "steps": [snapshotIndex(f) for f in files]}
+    with open(join(path, "meta.json.tmp"), "w") as f:
+        json.dump(meta, f)
+    # unwritten tiles stay zero (not present), the files are sparse until then
+    np.lib.format.open_memmap(join(path, "positions.npy"), mode="w+", dtype=np.float32, shape=shape + (3,)).flush()
+    np.lib.format.open_memmap(join(path, "status.npy"), mode="w+", dtype=np.uint8, shape=shape).flush()
+
+    tiles = [[join(folder, f) for f in files[start:start + stepChunk]] for start in range(0, len(files), stepChunk)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(convertTile, [path] * len(tiles), tiles, range(len(tiles))))
+    # the store is complete once meta.json exists
+    os.replace(join(path, "meta.json.tmp"), join(path, "meta.json"))
+    return TrajectoryStore(path)
+
+class TrajectoryStore:
+    def __init__(self, path):
+        with open(join(path, "meta.json"), "r") as f:
+            meta = json.load(f)
+        self.particles = meta["particles"]
+        # the snapshot index of every column
+        self.steps = np.array(meta["steps"])
+        self.positions = np.load(join(path, "positions.npy"), mmap_mode="r")
+        self.status = np.load(join(path, "status.npy"), mmap_mode="r")
+        _, _, self.particleChunk, self.stepChunk = self.status.shape
+
+    def column(self, index):
+        # the column of a snapshot index
+        column = np.searchsorted(self.steps, index)
+        if column == len(self.steps) or self.steps[column] != index:
+            raise KeyError(f"Snapshot {index} is not in the store")
+        return column
+
+    def trajectory(self, particle):
+        # (positions (steps, 3), status bits (steps,)) of one particle over every snapshot
+        tile, row = divmod(particle, self.particleChunk)
+        xyz = self.positions[tile, :, row].reshape(-1, 3)[:len(self.steps)]
+        return np.array(xyz), np.array(self.status[tile, :, row].reshape(-1)[:len(self.steps)])
+
+    def cloud(self, index):
+        # (positions (particles, 3), status bits (particles,)) of one snapshot
+        tile, offset = divmod(self.column(index), self.stepChunk)
+        xyz = self.positions[:, tile, :, offset].reshape(-1, 3)[:self.particles]
+        return np.array(xyz), np.array(self.status[:, tile, :, offset].reshape(-1)[:self.particles])
+
+    def firstSteps(self, bit):
+        # Snapshot index at which each particle first has the status bit, -1 if never, one particle tile at a time
+        result = np.full(self.particles, -1, dtype=np.int64)
+        for tile in range(self.status.shape[0]):
+            flags = (self.status[tile] & bit).transpose(1, 0, 2).reshape(self.particleChunk, -1)[:, :len(self.steps)] != 0
+            first = np.where(flags.any(axis=1), self.steps[np.argmax(flags, axis=1)], -1)
+            start = tile * self.particleChunk
+            result[start:start + self.particleChunk] = first[:self.particles - start]
+        return result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Memory-mapped particle trajectories of a snapshot series")
+    parser.add_argument("command", help="convert, particle or snapshot")
+    parser.add_argument("paths", nargs="+", help="convert: <folder> <store>, particle: <store> <particle>, snapshot: <store> <snapshot index>")
+    parser.add_argument("--workers", help="the number of conversion processes", type=int, default=4)
+    parser.add_argument("--particleChunk", help="particles per tile", type=int, default=4096)
+    parser.add_argument("--stepChunk", help="snapshots per tile", type=int, default=64)
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        folder, path = args.paths
+        store = convert(folder, path, args.workers, args.particleChunk, args.stepChunk)
+        print("Converted: ", len(store.steps), " snapshots of ", store.particles, " particles")
+    elif args.command == "particle":
+        store = TrajectoryStore(args.paths[0])
+        xyz, bits = store.trajectory(int(args.paths[1]))
+        print(pd.DataFrame({"snapshot": store.steps, "x": xyz[:, 0], "y": xyz[:, 1], "z": xyz[:, 2],
+                            "present": bits & present != 0, "deposition": bits & deposited != 0,
+                            "escaped": bits & escaped != 0, "error": bits & errored != 0}).to_string(index=False))
+    elif args.command == "snapshot":
+        store = TrajectoryStore(args.paths[0])
+        xyz, bits = store.cloud(int(args.paths[1]))
+        print(len(xyz), " particles, ", np.count_nonzero(bits & deposited), " deposited, ", np.count_nonzero(bits & escaped), " escaped")
+    else:
+        print("Invalid command")
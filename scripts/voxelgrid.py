@@ -0,0 +1,157 @@
+# Voxel label grid over the airway for constant time particle to segment lookup
+# Usage: python voxelgrid.py <grid path> --voxelSize <voxel size> --moreSegments
+# Builds (or checks) the grid ahead of time, deposition_fraction.py --voxelGrid builds it on first use
+
+import os
+import json
+import argparse
+import numpy as np
+
+from segments import (classify, geometryVersion, sphereTable, sphereCenters, sphereRadii, sphereLabels,
+                      subdivisionPlanes, planeNames, planeMatrix, planeRefValues, planeKeep, planeOther)
+
+# Label of a voxel that straddles a segment boundary, its points are classified exactly
+BOUNDARY = -2
+
+def airwayBounds():
+    # Bounding box of the segment spheres, extended up to the segment 1 slab
+    low = (sphereCenters - sphereRadii[:, None]).min(axis=0)
+    high = (sphereCenters + sphereRadii[:, None]).max(axis=0)
+    high[2] = max(high[2], -0.06)
+    return low, high
+
+def planeSplit(row, lo, hi):
+    # Side of plane row for every box: keep or other segment, BOUNDARY if the box crosses it
+    a = planeMatrix[row, :3]
+    valMin = np.minimum(lo*a, hi*a).sum(axis=1) + planeMatrix[row, 3]
+    valMax = np.maximum(lo*a, hi*a).sum(axis=1) + planeMatrix[row, 3]
+    refVal = planeRefValues[row]
+    keepAll = (valMin > 0) if refVal > 0 else (valMax < 0) if refVal < 0 else np.zeros(len(lo), dtype=bool)
+    otherAll = (valMax < 0) if refVal > 0 else (valMin > 0) if refVal < 0 else np.ones(len(lo), dtype=bool)
+    return np.where(keepAll, planeKeep[row], np.where(otherAll, planeOther[row], BOUNDARY))
+
+def sphereDistances(lo, hi):
+    # Squared nearest and farthest distance from each box [lo, hi] to each sphere center, per axis
+    near = np.maximum(np.maximum(lo[:, None, :] - sphereCenters, sphereCenters - hi[:, None, :]), 0)
+    far = np.maximum(np.abs(lo[:, None, :] - sphereCenters), np.abs(hi[:, None, :] - sphereCenters))
+    return near**2, far**2
+
+def boxLabels(lo, hi, moreSeg=False, near2=None, far2=None):
+    # Section shared by every point of each box [lo, hi], BOUNDARY if the rules disagree inside it
+    n = len(lo)
+    if near2 is None:
+        near2, far2 = (d.sum(axis=2) for d in sphereDistances(lo, hi))
+    rules = [
+        (lo[:, 2] >= -0.06, hi[:, 2] < -0.06, 1),
+        ((lo[:, 2] >= -0.187) & (lo[:, 0] >= -0.0165) & (hi[:, 0] < 0.020),
+         (hi[:, 2] < -0.187) | (hi[:, 0] < -0.0165) | (lo[:, 0] >= 0.020), 2),
+    ]
+
+    fullyIn = far2 < sphereRadii**2
+    fullyOut = near2 >= sphereRadii**2
+    for segment, _ in sphereTable:
+        columns = sphereLabels == segment
+        value = segment
+        if moreSeg and segment in subdivisionPlanes:
+            value = planeSplit(planeNames.index(subdivisionPlanes[segment]), lo, hi)
+        rules.append((fullyIn[:, columns].any(axis=1), fullyOut[:, columns].all(axis=1), value))
+
+    label = np.full(n, BOUNDARY, dtype=np.int8)
+    undecided = np.ones(n, dtype=bool)
+    for inside, outside, value in rules:
+        decided = undecided & inside
+        label[decided] = np.broadcast_to(value, n)[decided]
+        # boxes that straddle the rule stay BOUNDARY
+        undecided &= outside
+    label[undecided] = -1
+    return label
+
+class VoxelGrid:
+    def __init__(self, path, voxelSize=0.001, moreSeg=False, blockSize=65536):
+        self.labelsPath = path + ".npy"
+        self.metaPath = path + ".json"
+        self.voxelSize = voxelSize
+        self.moreSeg = moreSeg
+        self.version = geometryVersion()
+        if not self.load():
+            print("Building voxel grid: " + self.labelsPath)
+            self.build(blockSize)
+            self.load()
+
+    def load(self):
+        if not (os.path.exists(self.labelsPath) and os.path.exists(self.metaPath)):
+            return False
+        with open(self.metaPath, "r") as f:
+            meta = json.load(f)
+        if (meta["version"], meta["voxelSize"], meta["moreSeg"]) != (self.version, self.voxelSize, self.moreSeg):
+            return False
+        self.origin = np.array(meta["origin"])
+        self.shape = tuple(meta["shape"])
+        self.labels = np.load(self.labelsPath, mmap_mode="r")
+        return self.labels.shape == self.shape
+
+    def build(self, blockSize=65536):
+        low, high = airwayBounds()
+        shape = tuple(int(n) for n in np.ceil((high - low) / self.voxelSize))
+        # boxes are widened a little so rounding in the index computation cannot cross a boundary
+        margin = self.voxelSize * 1e-6
+
+        # the grid is a tensor product, so the sphere distances are summed from per axis tables
+        axes = [low[a] + np.arange(shape[a]) * self.voxelSize for a in range(3)]
+        axisLo = np.zeros((max(shape), 3))
+        axisHi = np.zeros((max(shape), 3))
+        for a in range(3):
+            axisLo[:shape[a], a] = axes[a] - margin
+            axisHi[:shape[a], a] = axes[a] + self.voxelSize + margin
+        axisNear, axisFar = sphereDistances(axisLo, axisHi)
+
+        tmpPath = self.labelsPath + ".tmp"
+        labels = np.lib.format.open_memmap(tmpPath, mode="w+", dtype=np.int8, shape=shape)
+        flat = labels.reshape(-1)
+        for start in range(0, flat.size, blockSize):
+            stop = min(start + blockSize, flat.size)
+            ijk = np.stack(np.unravel_index(np.arange(start, stop), shape), axis=1)
+            lo = axisLo[ijk, [0, 1, 2]]
+            hi = axisHi[ijk, [0, 1, 2]]
+            near2 = axisNear[ijk[:, 0], :, 0] + axisNear[ijk[:, 1], :, 1] + axisNear[ijk[:, 2], :, 2]
+            far2 = axisFar[ijk[:, 0], :, 0] + axisFar[ijk[:, 1], :, 1] + axisFar[ijk[:, 2], :, 2]
+            flat[start:stop] = boxLabels(lo, hi, self.moreSeg, near2, far2)
+        labels.flush()
+        del flat, labels
+        os.replace(tmpPath, self.labelsPath)
+
+        meta = {"version": self.version, "voxelSize": self.voxelSize, "moreSeg": self.moreSeg,
+                "origin": low.tolist(), "shape": list(shape)}
+        with open(self.metaPath + ".tmp", "w") as f:
+            json.dump(meta, f)
+        os.replace(self.metaPath + ".tmp", self.metaPath)
+
+    def boundaryFraction(self):
+        return np.count_nonzero(np.asarray(self.labels) == BOUNDARY) / self.labels.size
+
+    def classify(self, x, y, z):
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        z = np.asarray(z, dtype=np.float64)
+
+        with np.errstate(invalid="ignore"):
+            ijk = np.floor((np.column_stack([x, y, z]) - self.origin) / self.voxelSize)
+        inGrid = np.all((ijk >= 0) & (ijk < self.shape), axis=1)
+        ijk = ijk[inGrid].astype(np.int64)
+
+        section = np.full(x.shape, BOUNDARY, dtype=np.int64)
+        section[inGrid] = self.labels[ijk[:, 0], ijk[:, 1], ijk[:, 2]]
+        exact = section == BOUNDARY
+        section[exact] = classify(x[exact], y[exact], z[exact], moreSeg=self.moreSeg)
+        return section
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the voxel label grid of the airway segments")
+    parser.add_argument("path", help="the grid path, <path>.npy and <path>.json are written")
+    parser.add_argument("--voxelSize", help="the voxel edge length", type=float, default=0.001)
+    parser.add_argument("--moreSegments", help="split the generation 13-22 segments into 23-32", action="store_true")
+    args = parser.parse_args()
+
+    grid = VoxelGrid(args.path, args.voxelSize, args.moreSegments)
+    print("Grid shape: ", grid.shape)
+    print("Boundary voxels percentage: ", grid.boundaryFraction() * 100)